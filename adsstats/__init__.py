@@ -1 +1,42 @@
-from stats_utils import generate
+import logging
+# progress is logged to the 'adsstats' logger; the application configures
+# where it goes
+logging.getLogger('adsstats').addHandler(logging.NullHandler())
+
+# The heavy lifting lives in 'stats_utils', which is only imported on
+# first use: importing the package itself is cheap and has no side effects
+def generate(**args):
+    from stats_utils import generate
+    return generate(**args)
+
+def generate_many(bibcode_sets, **args):
+    from stats_utils import generate_many
+    return generate_many(bibcode_sets, **args)
+
+def http_stats():
+    from client import http_stats
+    return http_stats()
+
+def executor_health():
+    from engine import executor_health
+    return executor_health()
+
+def shutdown():
+    from engine import shutdown_executor
+    shutdown_executor()
+
+def cache_stats():
+    from cache import cache_stats
+    return cache_stats()
+
+def set_cache(cache):
+    from cache import set_cache
+    set_cache(cache)
+
+def result_cache_stats():
+    from cache import result_cache_stats
+    return result_cache_stats()
+
+def set_data_epoch(epoch):
+    from cache import set_data_epoch
+    set_data_epoch(epoch)
@@ -0,0 +1,134 @@
+import numpy as np
+
+# first year for which reads and downloads are recorded
+READS_START_YEAR = 1996
+
+def csr_offsets(lengths):
+    """
+    Turns a list of row lengths into the (N+1) offsets of a CSR structure
+    """
+    offsets = np.zeros(len(lengths)+1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+def csr_take(offsets, index):
+    """
+    Returns the new offsets and the positions in the value arrays for
+    the rows 'index' of a CSR structure
+    """
+    lengths = (offsets[1:] - offsets[:-1])[index]
+    new_offsets = csr_offsets(lengths)
+    positions = np.repeat(offsets[:-1][index] - new_offsets[:-1], lengths) + \
+                np.arange(new_offsets[-1], dtype=np.int64)
+    return new_offsets, positions
+
+class AttributeStore(object):
+    """
+    Columnar store of the attributes of a list of publications, used as
+    input by all models. There is one entry per publication in the
+    per-paper columns:
+
+        bibcodes            list with the bibcodes
+        year                publication year
+        refereed            refereed flag
+        citations           number of citations
+        refereed_citations  number of refereed citations
+        authors             number of authors (at least 1)
+        reads               total number of reads
+        downloads           total number of downloads
+
+    The yearly reads and the citations are stored in CSR form: the entries
+    for paper i are found at positions reads_offsets[i]:reads_offsets[i+1]
+    of 'reads_values' (reads per year, starting at READS_START_YEAR) and
+    cit_offsets[i]:cit_offsets[i+1] of the citation columns:
+
+        cit_year            publication year of the citing paper
+        cit_refs            number of references in the citing paper
+        cit_refereed        refereed flag of the citing paper
+
+    Refereed and non-refereed citations are selected with 'cit_refereed'.
+    """
+    def __init__(self, bibcodes, refereed, authors, reads, downloads,
+                 reads_offsets, reads_values, cit_offsets, cit_year,
+                 cit_refs, cit_refereed):
+        self.bibcodes = list(bibcodes)
+        self.year = np.array([int(b[:4]) for b in self.bibcodes], dtype=np.int16)
+        self.refereed = np.asarray(refereed, dtype=bool)
+        self.authors = np.asarray(authors, dtype=np.int32)
+        self.reads = np.asarray(reads, dtype=np.int64)
+        self.downloads = np.asarray(downloads, dtype=np.int64)
+        self.reads_offsets = np.asarray(reads_offsets, dtype=np.int64)
+        self.reads_values = np.asarray(reads_values, dtype=np.int32)
+        self.cit_offsets = np.asarray(cit_offsets, dtype=np.int64)
+        self.cit_year = np.asarray(cit_year, dtype=np.int16)
+        self.cit_refs = np.asarray(cit_refs, dtype=np.int32)
+        self.cit_refereed = np.asarray(cit_refereed, dtype=bool)
+        self.citations = (self.cit_offsets[1:] - self.cit_offsets[:-1]).astype(np.int32)
+        self.refereed_citations = np.bincount(self.cit_paper[self.cit_refereed],
+                                              minlength=len(self)).astype(np.int32)
+
+    def __len__(self):
+        return len(self.bibcodes)
+
+    @property
+    def weights(self):
+        """
+        The normalization weight (1/number of authors) of every paper
+        """
+        return 1.0/self.authors.astype(float)
+
+    @property
+    def cit_paper(self):
+        """
+        For every citation, the index of the cited paper
+        """
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.citations)
+
+    @property
+    def reads_paper(self):
+        """
+        For every entry in 'reads_values', the index of the paper
+        """
+        return np.repeat(np.arange(len(self), dtype=np.int64),
+                         self.reads_offsets[1:] - self.reads_offsets[:-1])
+
+    @property
+    def reads_year(self):
+        """
+        For every entry in 'reads_values', the year of the reads
+        """
+        lengths = self.reads_offsets[1:] - self.reads_offsets[:-1]
+        return READS_START_YEAR + np.arange(len(self.reads_values), dtype=np.int64) - \
+               np.repeat(self.reads_offsets[:-1], lengths)
+
+    def reads_matrix(self):
+        """
+        Returns the yearly reads as a dense (papers x years) matrix: column j
+        holds the reads in year READS_START_YEAR+j
+        """
+        lengths = self.reads_offsets[1:] - self.reads_offsets[:-1]
+        Nyears = int(lengths.max()) if len(lengths) else 0
+        matrix = np.zeros((len(self), Nyears), dtype=np.int32)
+        matrix[self.reads_paper, self.reads_year - READS_START_YEAR] = self.reads_values
+        return matrix
+
+    def take(self, index):
+        """
+        Returns a new store with the papers at positions 'index', in that order
+        """
+        index = np.asarray(index, dtype=np.int64)
+        reads_offsets, reads_pos = csr_take(self.reads_offsets, index)
+        cit_offsets, cit_pos = csr_take(self.cit_offsets, index)
+        return AttributeStore([self.bibcodes[i] for i in index],
+                              self.refereed[index], self.authors[index],
+                              self.reads[index], self.downloads[index],
+                              reads_offsets, self.reads_values[reads_pos],
+                              cit_offsets, self.cit_year[cit_pos],
+                              self.cit_refs[cit_pos], self.cit_refereed[cit_pos])
+
+    def sort_by_citations(self):
+        """
+        Returns a new store sorted by number of citations (descending),
+        keeping the original order for papers with equal citations
+        """
+        return self.take(np.argsort(-self.citations.astype(np.int64), kind='mergesort'))
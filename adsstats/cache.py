@@ -0,0 +1,437 @@
+import os
+import time
+import hashlib
+import tempfile
+import threading
+import cPickle as pickle
+from collections import OrderedDict
+# metrics specific modules
+from config import config
+from adsstats.instrument import logger, count
+
+class MemoryCache(object):
+    """
+    Thread safe LRU cache, limited by the (pickled) size of its values
+    in bytes. Every entry carries its own expiry time.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now=None):
+        """
+        Returns (found, value); expired entries are dropped
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            try:
+                expires, size, value = self._entries.pop(key)
+            except KeyError:
+                return False, None
+            if expires < now:
+                self.bytes -= size
+                return False, None
+            # re-insert, so that the entry becomes the most recently used
+            self._entries[key] = (expires, size, value)
+            return True, value
+
+    def put(self, key, value, size, expires):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (expires, size, value)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, old_size, _) = self._entries.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+class DiskCache(object):
+    """
+    Cache with one pickle file per entry in the directory 'path'.
+    Files are written to a temporary file first and then renamed, so
+    concurrent readers never see partial entries. The modification time
+    of a file is set to the expiry time of its entry: when the files take
+    more than 'max_bytes', the expired files and then the files that
+    expire first are removed (see 'prune').
+    """
+    def __init__(self, path, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = config.METRICS_CACHE_DISK_MAX_BYTES
+        self.path = path
+        self.max_bytes = max_bytes
+        # size of the files, known after the first 'prune'
+        self.bytes = None
+        self._lock = threading.Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _file(self, key):
+        digest = hashlib.md5(pickle.dumps(key, 2)).hexdigest()
+        return os.path.join(self.path, digest[:2], digest)
+
+    def get(self, key, now=None):
+        if now is None:
+            now = time.time()
+        try:
+            with open(self._file(key), 'rb') as f:
+                stored_key, expires, value = pickle.load(f)
+        except:
+            return False, None
+        if stored_key != key:
+            return False, None
+        if expires < now:
+            try:
+                os.remove(self._file(key))
+            except OSError:
+                pass
+            return False, None
+        return True, (expires, value)
+
+    def put(self, key, data, expires):
+        filename = self._file(key)
+        directory = os.path.dirname(filename)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmpname = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmpname, filename)
+            os.utime(filename, (expires, expires))
+        except:
+            # the disk tier is an optimization only
+            return
+        with self._lock:
+            if self.bytes is None:
+                self.prune()
+            else:
+                self.bytes += len(data)
+            if self.bytes > self.max_bytes:
+                self.prune()
+
+    def prune(self, now=None):
+        """
+        Removes the expired files and, while the files take more than
+        'max_bytes', the files that expire first (down to 90% of it)
+        """
+        if now is None:
+            now = time.time()
+        files = []
+        for (directory, _, names) in os.walk(self.path):
+            for name in names:
+                filename = os.path.join(directory, name)
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, filename))
+        files.sort()
+        total = sum(size for (_, size, _) in files)
+        limit = total > self.max_bytes and 0.9*self.max_bytes or self.max_bytes
+        for (expires, size, filename) in files:
+            if expires >= now and total <= limit:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+        self.bytes = total
+
+class DataCache(object):
+    """
+    Two tier (memory, optional disk) cache for the per-bibcode data,
+    keyed on (data type, data epoch, bibcode), so that data from before
+    a 'set_data_epoch' are never used. Every data type has its own time
+    to live (see METRICS_CACHE_TTL); data types without a TTL are not
+    cached.
+    """
+    def __init__(self, max_bytes=None, path=None, ttl=None):
+        if max_bytes is None:
+            max_bytes = config.METRICS_CACHE_MAX_BYTES
+        if path is None:
+            path = config.METRICS_CACHE_DIR
+        if ttl is None:
+            ttl = config.METRICS_CACHE_TTL
+        self.ttl = dict(ttl)
+        self.memory = MemoryCache(max_bytes)
+        self.disk = None
+        if path:
+            self.disk = DiskCache(path)
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def _count(self, kind, counter, n=1):
+        with self._lock:
+            counts = self._counts.setdefault(kind, {'hits':0, 'disk_hits':0, 'misses':0})
+            counts[counter] += n
+
+    def get(self, kind, key):
+        """
+        Returns (found, value) for the entry 'key' of type 'kind'
+        """
+        if kind not in self.ttl:
+            return False, None
+        now = time.time()
+        key = (kind, data_epoch(), key)
+        found, value = self.memory.get(key, now)
+        if found:
+            self._count(kind, 'hits')
+            count('cache_hits')
+            return True, value
+        if self.disk is not None:
+            found, entry = self.disk.get(key, now)
+            if found:
+                expires, value = entry
+                self._count(kind, 'disk_hits')
+                count('cache_disk_hits')
+                self.memory.put(key, value, len(pickle.dumps(value, 2)), expires)
+                return True, value
+        self._count(kind, 'misses')
+        count('cache_misses')
+        return False, None
+
+    def get_many(self, kind, keys):
+        """
+        Returns a dictionary with the cached entries and a list
+        with the keys that were not found
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            hit, value = self.get(kind, key)
+            if hit:
+                found[key] = value
+            else:
+                missing.append(key)
+        return found, missing
+
+    def put(self, kind, key, value):
+        if kind not in self.ttl:
+            return
+        expires = time.time() + self.ttl[kind]
+        key = (kind, data_epoch(), key)
+        data = pickle.dumps(value, 2)
+        self.memory.put(key, value, len(data), expires)
+        if self.disk is not None:
+            self.disk.put(key, pickle.dumps((key, expires, value), 2), expires)
+
+    def clear(self):
+        self.memory.clear()
+
+    def stats(self):
+        with self._lock:
+            counts = dict((kind, dict(c)) for (kind, c) in self._counts.items())
+        return {'types': counts,
+                'entries': len(self.memory),
+                'bytes': self.memory.bytes,
+                'max_bytes': self.memory.max_bytes,
+                'evictions': self.memory.evictions}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """
+    Returns the shared data cache, or None when caching is disabled
+    """
+    global _cache
+    if not config.METRICS_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = DataCache()
+        return _cache
+
+def set_cache(cache):
+    """
+    Use 'cache' as the shared data cache (None: a new DataCache on next
+    use). Any object with the methods of DataCache that are used by the
+    fetches can be plugged in, e.g. a client for a shared cache server:
+
+        get_many(kind, keys)    returns a dictionary with the entries found
+                                and a list with the keys that were not
+        put(kind, key, value)   stores an entry (values are picklable)
+        clear()                 called by 'set_data_epoch'; entries from an
+                                older epoch must not be returned after it
+        stats()                 a dictionary for 'cache_stats'
+
+    'kind' is the data type ('publication', 'citations', 'mongo') and
+    'key' a bibcode.
+    """
+    global _cache
+    with _cache_lock:
+        _cache = cache
+
+def cache_stats():
+    cache = get_cache()
+    if cache is None:
+        return {}
+    return cache.stats()
+
+def data_epoch():
+    """
+    Returns the token for the current version of the underlying data
+    """
+    return _epoch
+
+def set_data_epoch(epoch):
+    """
+    Set a new data epoch (e.g. after an index refresh): cached results
+    and data for older epochs are no longer used, and the cached data in
+    memory are dropped (those on disk expire or are pruned)
+    """
+    global _epoch
+    _epoch = str(epoch)
+    if _cache is not None:
+        _cache.clear()
+
+_epoch = str(config.METRICS_DATA_EPOCH)
+
+def result_key(args):
+    """
+    Returns the cache key for the arguments of a 'generate' call, or None
+    if the results cannot be cached. The key is a hash of the sorted set
+    of bibcodes (or the query), the requested types, the output format
+    and the data epoch.
+    """
+    if 'bibcodes' in args:
+        source = sorted(set(map(lambda a: a.strip(), args['bibcodes'])))
+    elif 'query' in args:
+        source = args['query']
+    else:
+        return None
+    try:
+        types = sorted(set(map(lambda a: a.strip(), args['types'].split(','))))
+    except:
+        types = sorted(config.METRICS_DEFAULT_MODELS)
+    key = pickle.dumps((source, types, args.get('fmt',''), data_epoch()), 2)
+    return hashlib.sha1(key).hexdigest()
+
+class ResultCache(object):
+    """
+    Cache for the results of 'generate'. Results are fresh for 'ttl'
+    seconds; for 'stale_ttl' seconds after that the stale result is
+    returned while a refresh runs in the background. Results are kept
+    pickled, so every caller gets its own copy.
+    """
+    def __init__(self, max_bytes=None, ttl=None, stale_ttl=None):
+        if max_bytes is None:
+            max_bytes = config.METRICS_RESULT_CACHE_MAX_BYTES
+        if ttl is None:
+            ttl = config.METRICS_RESULT_TTL
+        if stale_ttl is None:
+            stale_ttl = config.METRICS_RESULT_STALE_TTL
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.memory = MemoryCache(max_bytes)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._counts = {'hits':0, 'stale_hits':0, 'misses':0, 'refreshes':0}
+
+    def _count(self, counter):
+        with self._lock:
+            self._counts[counter] += 1
+
+    def get(self, args, compute):
+        """
+        Returns the results for 'args', calling 'compute(args)' when
+        they are not in the cache (or are being refreshed)
+        """
+        key = result_key(args)
+        if key is None:
+            return compute(args)
+        now = time.time()
+        found, entry = self.memory.get(key, now)
+        if found:
+            fresh_until, data = entry
+            if now < fresh_until:
+                self._count('hits')
+                count('result_cache_hits')
+                return pickle.loads(data)
+            self._count('stale_hits')
+            count('result_cache_stale_hits')
+            self._refresh(key, args, compute)
+            return pickle.loads(data)
+        self._count('misses')
+        count('result_cache_misses')
+        return self._compute(key, args, compute)
+
+    def _compute(self, key, args, compute):
+        results = compute(args)
+        now = time.time()
+        data = pickle.dumps(results, 2)
+        self.memory.put(key, (now + self.ttl, data), len(data), now + self.ttl + self.stale_ttl)
+        return results
+
+    def _refresh(self, key, args, compute):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self._counts['refreshes'] += 1
+        def run():
+            try:
+                self._compute(key, args, compute)
+            except:
+                logger.exception('Refresh of cached results failed')
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+        # refreshes share the few background threads of the executor
+        from adsstats.engine import get_executor
+        try:
+            get_executor().run_in_background(run)
+        except:
+            with self._lock:
+                self._refreshing.discard(key)
+            raise
+
+    def clear(self):
+        self.memory.clear()
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+            counts['refreshing'] = len(self._refreshing)
+        counts.update({'entries': len(self.memory),
+                       'bytes': self.memory.bytes,
+                       'max_bytes': self.memory.max_bytes,
+                       'evictions': self.memory.evictions})
+        return counts
+
+_result_cache = None
+
+def get_result_cache():
+    """
+    Returns the shared result cache, or None when it is disabled
+    """
+    global _result_cache
+    if not config.METRICS_RESULT_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+        return _result_cache
+
+def result_cache_stats():
+    cache = get_result_cache()
+    if cache is None:
+        return {}
+    return cache.stats()
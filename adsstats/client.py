@@ -0,0 +1,87 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+# metrics specific modules
+from config import config
+
+class HTTPClient(object):
+    """
+    Connection pooling HTTP client for the Solr traffic. All requests go
+    through one requests.Session, so connections are kept alive and reused
+    across calls and across worker threads.
+    """
+    def __init__(self, pool_size=None, timeout=None, block=None):
+        if pool_size is None:
+            pool_size = config.METRICS_HTTP_POOL_SIZE
+        if timeout is None:
+            timeout = config.METRICS_HTTP_TIMEOUT
+        if block is None:
+            block = config.METRICS_HTTP_POOL_BLOCK
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self.adapter = HTTPAdapter(pool_connections=pool_size,
+                                   pool_maxsize=pool_size,
+                                   pool_block=block)
+        self.session = requests.Session()
+        self.session.headers['Connection'] = 'keep-alive'
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._in_flight = 0
+
+    def get(self, url, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        with self._lock:
+            self._requests += 1
+            self._in_flight += 1
+        try:
+            return self.session.get(url, timeout=timeout, **kwargs)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def stats(self):
+        """
+        Returns the pool statistics: the number of requests, the number of
+        requests that reused a pooled connection (hits), the number of
+        connections that had to be opened and the requests in flight
+        """
+        connections = 0
+        pooled_requests = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            pooled_requests += pool.num_requests
+        with self._lock:
+            return {'requests': self._requests,
+                    'hits': max(0, pooled_requests - connections),
+                    'new_connections': connections,
+                    'in_flight': self._in_flight,
+                    'pool_size': self.pool_size}
+
+    def close(self):
+        self.session.close()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """
+    Returns the shared client. A forked worker process gets its own client,
+    so that sockets are never shared between processes.
+    """
+    global _client
+    with _client_lock:
+        if _client is None or _client.pid != os.getpid():
+            _client = HTTPClient()
+        return _client
+
+def http_stats():
+    return get_client().stats()
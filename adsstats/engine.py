@@ -0,0 +1,230 @@
+import os
+import sys
+import time
+import atexit
+import threading
+import Queue
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+# metrics specific modules
+from config import config
+from adsstats import instrument
+
+def _run(func, args, recorder):
+    # the task is recorded for the request that submitted it
+    previous = instrument.activate(recorder)
+    try:
+        return True, func(*args)
+    except Exception:
+        return False, sys.exc_info()
+    finally:
+        instrument.activate(previous)
+
+def _ping():
+    return os.getpid()
+
+class Executor(object):
+    """
+    The worker pools of a process, created once and shared by all
+    requests: 'threads' threads for the I/O bound fetch stages, 'background'
+    threads for work that nobody waits for (e.g. refreshing cached results)
+    and, when 'processes' is set, worker processes for CPU bound work.
+    Requests only schedule tasks on them (see 'IOEngine'); no pools are
+    started or torn down per request. Background tasks have their own pool
+    because they run whole requests, which wait for the fetch threads.
+    """
+    def __init__(self, threads=None, processes=None, background=None):
+        if threads is None:
+            threads = config.METRICS_THREADS
+        if processes is None:
+            processes = config.METRICS_PROCESSES
+        if background is None:
+            background = config.METRICS_BACKGROUND_THREADS
+        self.threads = threads
+        self.processes = processes
+        self.background = background
+        self.pid = os.getpid()
+        self.closed = False
+        # the worker processes are forked before any threads are started
+        self.process_pool = None
+        if processes:
+            self.process_pool = multiprocessing.Pool(processes)
+        self.thread_pool = ThreadPool(threads)
+        self.background_pool = ThreadPool(background)
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._pending = 0
+
+    def _finished(self, callback):
+        def finished(result):
+            with self._lock:
+                self._pending -= 1
+            if callback is not None:
+                callback(result)
+        return finished
+
+    def apply_async(self, func, args=(), callback=None):
+        """
+        Run 'func(*args)' on the thread pool; 'callback' gets the result
+        """
+        if self.closed:
+            raise RuntimeError('The executor has been shut down')
+        with self._lock:
+            self._submitted += 1
+            self._pending += 1
+        return self.thread_pool.apply_async(func, args, callback=self._finished(callback))
+
+    def map(self, func, iterable):
+        return self.thread_pool.map(func, iterable)
+
+    def run_in_background(self, func, args=()):
+        """
+        Run 'func(*args)' on the background threads; tasks wait in a queue
+        while all of them are busy
+        """
+        if self.closed:
+            raise RuntimeError('The executor has been shut down')
+        return self.background_pool.apply_async(func, args)
+
+    def process_map(self, func, iterable):
+        """
+        Map 'func' over 'iterable' on the worker processes ('func' and the
+        items are pickled), or in this thread when there are none
+        """
+        if self.process_pool is None:
+            return map(func, iterable)
+        return self.process_pool.map(func, iterable)
+
+    def stats(self):
+        with self._lock:
+            return {'threads': self.threads,
+                    'processes': self.processes,
+                    'background': self.background,
+                    'submitted': self._submitted,
+                    'pending': self._pending}
+
+    def health(self, timeout=None):
+        """
+        Checks that the workers are alive and that a no-op task makes a
+        round trip through every pool within 'timeout' seconds (default:
+        METRICS_HEALTH_TIMEOUT). 'ok' is False when the executor is shut
+        down, a worker died or a pool does not respond in time.
+        """
+        if timeout is None:
+            timeout = config.METRICS_HEALTH_TIMEOUT
+        health = self.stats()
+        health['closed'] = self.closed
+        pools = [('threads', self.thread_pool), ('background', self.background_pool)]
+        if self.process_pool is not None:
+            pools.append(('processes', self.process_pool))
+        ok = not self.closed
+        for (name, pool) in pools:
+            # '_pool' holds the workers of a multiprocessing pool
+            health[name + '_alive'] = sum(1 for w in pool._pool if w.is_alive())
+            health[name + '_ping'] = None
+            if not self.closed:
+                stime = time.time()
+                try:
+                    pool.apply_async(_ping).get(timeout)
+                    health[name + '_ping'] = time.time() - stime
+                except multiprocessing.TimeoutError:
+                    pass
+            ok = ok and health[name + '_alive'] == getattr(self, name) and health[name + '_ping'] is not None
+        health['ok'] = ok
+        return health
+
+    def shutdown(self, wait=True):
+        """
+        Stop the pools: with 'wait' the tasks already scheduled are finished
+        first, otherwise the workers are stopped right away
+        """
+        self.closed = True
+        for pool in (self.thread_pool, self.background_pool, self.process_pool):
+            if pool is None:
+                continue
+            if wait:
+                pool.close()
+            else:
+                pool.terminate()
+            pool.join()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """
+    Returns the shared executor, which is started on first use. A forked
+    worker process gets its own executor (threads do not survive a fork).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None or _executor.closed or _executor.pid != os.getpid():
+            _executor = Executor()
+        return _executor
+
+def shutdown_executor(wait=True):
+    """
+    Shut the shared executor down; the next 'get_executor' starts a new one
+    """
+    with _executor_lock:
+        executor = _executor
+    if executor is not None and executor.pid == os.getpid() and not executor.closed:
+        executor.shutdown(wait)
+
+def executor_health():
+    """
+    The health of the shared executor (see 'Executor.health'). This does
+    not start an executor: when there is none, or it has been shut down,
+    the report says so and 'ok' is False.
+    """
+    with _executor_lock:
+        executor = _executor
+    if executor is None or executor.pid != os.getpid():
+        return {'started': False, 'ok': False}
+    return executor.health()
+
+atexit.register(shutdown_executor, False)
+
+class IOEngine(object):
+    """
+    Runs the I/O bound fetch stages (Solr, MongoDB) of one request on the
+    threads of the shared executor. Workers only fetch and return their
+    results: the callback given with a task is run in the thread calling
+    'wait', so merging results never needs locks or shared structures. A
+    callback may submit follow-up tasks (e.g. the citation and MongoDB
+    fetches for a chunk as soon as its publication data is in); 'wait'
+    returns when all tasks are done.
+    """
+    def __init__(self, executor=None):
+        if executor is None:
+            executor = get_executor()
+        self.executor = executor
+        self.threads = executor.threads
+        self._done = Queue.Queue()
+        self._lock = threading.Lock()
+        self._outstanding = 0
+
+    def submit(self, func, *args, **kwargs):
+        callback = kwargs.get('callback')
+        with self._lock:
+            self._outstanding += 1
+        self.executor.apply_async(_run, (func, args, instrument.current()),
+                                  callback=lambda result: self._done.put((callback, result)))
+
+    def wait(self):
+        """
+        Run the callbacks of finished tasks, in order of completion, until
+        no tasks are left. The first exception raised by a task or a
+        callback is re-raised here.
+        """
+        while True:
+            with self._lock:
+                if not self._outstanding:
+                    return
+            callback, (ok, value) = self._done.get()
+            with self._lock:
+                self._outstanding -= 1
+            if not ok:
+                raise value[0], value[1], value[2]
+            if callback is not None:
+                callback(value)
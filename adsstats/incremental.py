@@ -0,0 +1,548 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime
+import math
+import numpy as np
+# metrics specific modules
+from config import config
+from adsstats.attributes import READS_START_YEAR
+from adsstats.stats_utils import get_attribute_store, count_citing, \
+     format_results, legacy_format
+
+def grow(array, rows):
+    """
+    Returns 'array' with at least 'rows' rows, padded with zeros
+    """
+    if len(array) >= rows:
+        return array
+    grown = np.zeros((max(rows, 2*len(array)),) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+def add_weighted(counts, sums, index, number, weight):
+    """
+    Adds 'number' entries of weight 'weight' at 'index' of the running
+    'counts' and (float) 'sums'. A sum without entries is set back to 0,
+    so that no rounding errors are left behind by removed entries.
+    """
+    counts[index] += number
+    if counts[index]:
+        sums[index] += number*weight
+    else:
+        sums[index] = 0.0
+
+def compensated_sum(pair, value):
+    """
+    Adds 'value' to a (sum, rounding error) pair (Kahan-Babuska): the two
+    add up to the exact sum of all values added, to about twice the float
+    precision
+    """
+    total, error = pair
+    new = total + value
+    rest = new - total
+    return (new, error + (total - (new - rest)) + (value - rest))
+
+def add_compensated(counts, sums, index, number, weight):
+    """
+    Like 'add_weighted', for sums kept as (sum, rounding error) pairs, so
+    that entries added and removed again leave no rounding errors behind
+    (for the tori index, where these could change the truncated roq index)
+    """
+    counts[index] += number
+    if counts[index]:
+        sums[index] = compensated_sum(sums[index], number*weight)
+    else:
+        sums[index] = (0.0, 0.0)
+
+class SortedCounts(object):
+    """
+    A multiset of counts, kept in ascending order together with a Fenwick
+    tree of its prefix sums. The order statistics and the sum of the
+    largest counts take O(log N) time. Changing a count moves it past the
+    blocks of equal counts in between, at O(log N) time per block, so that
+    adding or removing one citation takes O(log N) time.
+    """
+    def __init__(self, values):
+        values = np.sort(np.asarray(values, dtype=np.int64))
+        cumsum = np.zeros(len(values)+1, dtype=np.int64)
+        np.cumsum(values, out=cumsum[1:])
+        index = np.arange(1, len(values)+1)
+        # tree[i] holds the sum of values[i-(i & -i):i]
+        self.tree = [0] + (cumsum[index] - cumsum[index - (index & -index)]).tolist()
+        self.values = values.tolist()
+        self.total = int(cumsum[-1])
+
+    def __len__(self):
+        return len(self.values)
+
+    def copy(self):
+        counts = SortedCounts([])
+        counts.values = list(self.values)
+        counts.tree = list(self.tree)
+        counts.total = self.total
+        return counts
+
+    def _set(self, i, value):
+        delta = value - self.values[i]
+        self.values[i] = value
+        i += 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, k):
+        """
+        Returns the sum of the k smallest counts
+        """
+        total = 0
+        while k > 0:
+            total += self.tree[k]
+            k -= k & -k
+        return total
+
+    def top(self, r):
+        """
+        Returns the sum of the r largest counts
+        """
+        return self.total - self.prefix(len(self.values) - r)
+
+    def move(self, old, new):
+        """
+        Replaces one count 'old' by 'new'. The blocks of equal counts in
+        between shift by one position, which changes one entry per block.
+        """
+        values = self.values
+        i = bisect_left(values, old)
+        if i == len(values) or values[i] != old:
+            raise ValueError('%s is not one of the counts' % old)
+        if new == old:
+            return
+        if new > old:
+            i = bisect_right(values, old) - 1
+            end = bisect_left(values, new)
+            while i + 1 < end:
+                last = bisect_right(values, values[i+1], i+1, end) - 1
+                self._set(i, values[i+1])
+                i = last
+        else:
+            start = bisect_right(values, new)
+            while i > start:
+                first = bisect_left(values, values[i-1], start, i)
+                self._set(i, values[i-1])
+                i = first
+        self._set(i, new)
+        self.total += new - old
+
+    def median(self):
+        N = len(self.values)
+        return np.median(self.values[(N-1)//2:N//2+1])
+
+    def indices(self):
+        """
+        Returns the Hirsch, g and i10 indices of the counts, as
+        'models.citation_indices' does for the counts in descending order
+        """
+        values = self.values
+        N = len(values)
+        # the r-th largest count minus r decreases with r
+        lo, hi = 0, N
+        while lo < hi:
+            r = (lo + hi + 1)//2
+            if values[N-r] >= r:
+                lo = r
+            else:
+                hi = r - 1
+        h = lo
+        # and so do the increments of (sum of the r largest counts) - r*r
+        lo, hi = 0, N
+        while lo < hi:
+            r = (lo + hi + 1)//2
+            if self.top(r) >= r*r:
+                lo = r
+            else:
+                hi = r - 1
+        g = lo
+        i10 = N - bisect_left(values, 10)
+        return h, g, i10
+
+class Bibliography(object):
+    """
+    Running state for the metrics of one bibliography, kept between
+    updates, so that a delta of new or removed citations and new
+    reads/downloads is applied in time proportional to the delta:
+
+        counts          the per-paper citations, refereed citations, reads
+                        and downloads of all and of the refereed papers,
+                        as SortedCounts (for h, g, i10, e and the medians),
+                        with their weighted (normalized) sums
+        tori            running (compensated) tori sums of all and refereed
+                        citations
+        cit_counts      citations (and their weights) per citing year and
+                        (refereed citation, refereed paper) group
+        reads_counts    reads (and their weights) per year, for all and
+                        refereed papers
+        series          for every year, the SortedCounts of the citations
+                        of the papers published by then, and the tori
+                        contributions that start counting in that year
+
+    Every citation updates the series of the years from its own year on,
+    so its cost grows with the number of years, not with the number of
+    papers or citations. The initial results are those of the models;
+    after an update the results of the models that depend on the delta
+    are derived from the running state. Sums of floats are not added up
+    in the order of a full run, so they can differ in the last digits
+    (and the roq index, which truncates, by 1 where it is a whole number).
+    """
+    def __init__(self, store, types=None):
+        import models
+        if types is None:
+            types = ','.join(config.METRICS_DEFAULT_MODELS)
+        self.model_classes = models.data_models(models=types.split(','))
+        self.bibcodes = list(store.bibcodes)
+        self.position = dict((bibcode,i) for (i,bibcode) in enumerate(store.bibcodes))
+        self.results = {}
+        data = models.ModelData(store)
+        num_cit, num_cit_ref = count_citing(store)
+        for (model_class, results) in zip(self.model_classes,
+                models.run_models(self.model_classes, store, num_citing=num_cit,
+                                  num_citing_ref=num_cit_ref, data=data)):
+            self.results[model_class] = results
+        self._init_state(store, data)
+
+    @classmethod
+    def from_bibcodes(cls, bibcodes, types=None):
+        """
+        Fetch the data for 'bibcodes' (with the configured backend)
+        and calculate the models in 'types'
+        """
+        return cls(get_attribute_store({'bibcodes':bibcodes}), types=types)
+
+    def _init_state(self, store, data):
+        import models
+        today = datetime.today()
+        self.year = store.year.tolist()
+        self.refereed = store.refereed.tolist()
+        self.authors = store.authors.tolist()
+        self.weights = store.weights.tolist()
+        self.min_year = int(store.year.min())
+        self.time_span = models.get_timespan(store.bibcodes)
+        cit_paper = data.get('cit_paper')
+        # the citations of every paper by (year, references, refereed flag) and by year
+        self.cited = [defaultdict(int) for b in self.bibcodes]
+        self.cited_years = [defaultdict(int) for b in self.bibcodes]
+        for (paper, year, refs, refereed) in zip(cit_paper.tolist(), store.cit_year.tolist(),
+                                                store.cit_refs.tolist(), store.cit_refereed.tolist()):
+            self.cited[paper][(year, refs, refereed)] += 1
+            self.cited_years[paper][year] += 1
+        # statistics
+        self.publications = data.get('statistics')['publications']
+        self.values = {}
+        self.counts = {}
+        self.normalized = {}
+        weights = data.get('weights')
+        for column in ('reads', 'downloads', 'citations', 'refereed_citations'):
+            values = getattr(store, column)
+            self.values[column] = values.tolist()
+            for (prefix, mask) in (('', slice(None)), ('refereed_', store.refereed)):
+                self.counts[(column, prefix)] = SortedCounts(values[mask])
+                self.normalized[(column, prefix)] = float(np.dot(values[mask], weights[mask]))
+        # tori
+        tori = data.get('tori_weights')
+        self.tori_counts = {'': len(tori), 'refereed_': int(store.cit_refereed.sum())}
+        self.tori_sums = {'': (math.fsum(tori.tolist()), 0.0),
+                          'refereed_': (math.fsum(tori[store.cit_refereed].tolist()), 0.0)}
+        # citation histograms, from the first publication year on
+        last_year = max([today.year, int(store.year.max())] + store.cit_year.tolist())
+        Nrows = last_year - self.min_year + 2
+        row = store.cit_year.astype(np.int64) - self.min_year
+        keep = row >= 0
+        index = 4*row[keep] + 2*store.cit_refereed[keep] + store.refereed[cit_paper[keep]]
+        self.cit_counts = np.bincount(index, minlength=4*Nrows).reshape(Nrows, 4)
+        self.cit_weights = np.bincount(index, weights=weights[cit_paper[keep]],
+                                       minlength=4*Nrows).astype(float).reshape(Nrows, 4)
+        # reads histogram, the negative yearly reads of a paper count as 0
+        lengths = store.reads_offsets[1:] - store.reads_offsets[:-1]
+        self.reads = [store.reads_values[start:start+n].tolist()
+                      for (start, n) in zip(store.reads_offsets[:-1], lengths)]
+        matrix = np.maximum(store.reads_matrix(), 0).astype(np.int64)
+        self.reads_counts = grow(np.array([matrix.sum(axis=0), matrix[store.refereed].sum(axis=0)]).T,
+                                 today.year - READS_START_YEAR + 2)
+        self.reads_weights = grow(np.array([weights.dot(matrix),
+                                            weights[store.refereed].dot(matrix[store.refereed])]).T,
+                                  len(self.reads_counts))
+        # series: citations before the first year count in the first year
+        Nyears = last_year - self.min_year + 1
+        index = np.maximum(row, 0)*len(store) + cit_paper
+        counts = np.bincount(index, minlength=Nyears*len(store)).reshape(Nyears, len(store))
+        counts = np.cumsum(counts, axis=0)
+        self.series = [SortedCounts(counts[i][store.year <= self.min_year + i]) for i in range(Nyears)]
+        tori_year = np.maximum(store.cit_year, store.year[cit_paper]) - self.min_year
+        self.series_tori_counts = np.bincount(tori_year, minlength=Nyears).tolist()
+        contributions = [[] for i in range(Nyears)]
+        for (i, weight) in zip(tori_year.tolist(), tori.tolist()):
+            contributions[i].append(weight)
+        self.series_tori_sums = [(math.fsum(c), 0.0) for c in contributions]
+
+    def _extend_series(self, year):
+        """
+        Adds the series state for the years up to 'year', which start
+        out like the last year (O(N) per year, once a year)
+        """
+        while self.min_year + len(self.series) <= year:
+            self.series.append(self.series[-1].copy())
+            self.series_tori_counts.append(0)
+            self.series_tori_sums.append((0.0, 0.0))
+
+    def _add_value(self, column, paper, delta):
+        """
+        Adds 'delta' to the value in 'column' of the paper at position 'paper'
+        """
+        old = self.values[column][paper]
+        new = self.values[column][paper] = old + delta
+        for prefix in (('', 'refereed_') if self.refereed[paper] else ('',)):
+            self.counts[(column, prefix)].move(old, new)
+            self.normalized[(column, prefix)] += delta*self.weights[paper]
+
+    def _add_citation(self, sign, paper, year, refs, refereed):
+        """
+        Adds (sign 1) or removes (sign -1) a citation of the paper at
+        position 'paper', from a paper published in 'year' with 'refs'
+        references and refereed flag 'refereed'
+        """
+        self._add_value('citations', paper, sign)
+        if refereed:
+            self._add_value('refereed_citations', paper, sign)
+        cited = self.cited[paper]
+        cited[(year, refs, refereed)] += sign
+        if not cited[(year, refs, refereed)]:
+            del cited[(year, refs, refereed)]
+        tori = 1.0/float(max(refs, config.METRICS_MIN_BIBLIO_LENGTH)*self.authors[paper])
+        for prefix in (('', 'refereed_') if refereed else ('',)):
+            add_compensated(self.tori_counts, self.tori_sums, prefix, sign, tori)
+        if year >= self.min_year:
+            self.cit_counts = grow(self.cit_counts, year - self.min_year + 1)
+            self.cit_weights = grow(self.cit_weights, len(self.cit_counts))
+            add_weighted(self.cit_counts, self.cit_weights,
+                         (year - self.min_year, 2*refereed + self.refereed[paper]),
+                         sign, self.weights[paper])
+        # the citation counts from the year both papers have been published
+        self._extend_series(year)
+        first = max(year, self.year[paper]) - self.min_year
+        add_compensated(self.series_tori_counts, self.series_tori_sums, first, sign, tori)
+        cited_years = self.cited_years[paper]
+        count = sum(n for (y, n) in cited_years.items() if y <= self.min_year + first)
+        for i in range(first, len(self.series)):
+            self.series[i].move(count, count + sign)
+            count += cited_years.get(self.min_year + i + 1, 0)
+        cited_years[year] += sign
+        if not cited_years[year]:
+            del cited_years[year]
+
+    def _add_reads(self, paper, year, reads):
+        """
+        Adds 'reads' reads in 'year' to the paper at position 'paper'
+        """
+        self._add_value('reads', paper, reads)
+        column = year - READS_START_YEAR
+        cells = self.reads[paper]
+        cells.extend([0]*(column + 1 - len(cells)))
+        old = cells[column]
+        cells[column] += reads
+        delta = max(cells[column], 0) - max(old, 0)
+        self.reads_counts = grow(self.reads_counts, column + 1)
+        self.reads_weights = grow(self.reads_weights, len(self.reads_counts))
+        for (i, include) in enumerate((True, self.refereed[paper])):
+            if include and delta:
+                add_weighted(self.reads_counts, self.reads_weights, (column, i),
+                             delta, self.weights[paper])
+
+    def _citations(self, citations):
+        """
+        Turns a list of (cited bibcode, citing bibcode, number of references
+        in the citing paper, citing paper refereed) into a list of (paper
+        position, year, references, refereed); citations of papers not in
+        the bibliography are skipped
+        """
+        return [(self.position[c[0]], int(c[1][:4]), c[2], bool(c[3]))
+                for c in citations if c[0] in self.position]
+
+    def update(self, add_citations=[], remove_citations=[], reads=[], downloads=[]):
+        """
+        Apply a delta and update the results of the models that depend on it:
+
+            add_citations       list of (cited bibcode, citing bibcode,
+            remove_citations     number of references, refereed flag)
+            reads               list of (bibcode, year, number of reads)
+            downloads           list of (bibcode, number of downloads)
+
+        Removed citations must be known. Raises ValueError, without
+        changing anything, when the delta cannot be applied.
+        """
+        import models
+        add_citations = self._citations(add_citations)
+        remove_citations = self._citations(remove_citations)
+        reads = [(self.position[r[0]], int(r[1]), r[2]) for r in reads if r[0] in self.position]
+        downloads = [(self.position[d[0]], d[1]) for d in downloads if d[0] in self.position]
+        # the whole delta is checked before the state is changed, so that
+        # a delta that cannot be applied leaves everything as it was;
+        # citations are removed before the new ones are added
+        removed = defaultdict(int)
+        for (paper, year, refs, refereed) in remove_citations:
+            removed[(paper, year, refs, refereed)] += 1
+        for ((paper, year, refs, refereed), number) in removed.items():
+            if self.cited[paper].get((year, refs, refereed), 0) < number:
+                raise ValueError('No citation of %s from %s with %s references' % (self.bibcodes[paper], year, refs))
+        if reads and min(r[1] for r in reads) < READS_START_YEAR:
+            raise ValueError('No reads are recorded before %s' % READS_START_YEAR)
+        changed = set()
+        for citation in remove_citations:
+            self._add_citation(-1, *citation)
+        for citation in add_citations:
+            self._add_citation(1, *citation)
+        if remove_citations or add_citations:
+            changed.update(models.DEPENDENCIES['citations'])
+        for (paper, year, number) in reads:
+            self._add_reads(paper, year, number)
+        for (paper, number) in downloads:
+            self._add_value('downloads', paper, number)
+        if reads or downloads:
+            changed.update(models.DEPENDENCIES['reads'])
+        self._derive(filter(lambda m: changed.intersection(m.requires), self.model_classes))
+
+    def _derive(self, model_classes):
+        """
+        Sets the results of the models in 'model_classes' from the running state
+        """
+        import models
+        self._intermediates = {}
+        num_cit, num_cit_ref = (2*self.counts[('citations', '')].total,
+                                2*self.counts[('refereed_citations', '')].total)
+        for model_class in model_classes:
+            model = model_class()
+            model.data = self
+            model.num_citing = num_cit
+            model.num_citing_ref = num_cit_ref
+            model.results = {}
+            if issubclass(model_class, models.Metrics):
+                self._metrics(model, 'refereed_' if model_class is models.RefereedMetrics else '')
+            elif issubclass(model_class, models.TimeSeries):
+                self._series(model)
+            elif model_class is models.ReadsHistogram:
+                self._reads_histogram(model)
+            else:
+                # the statistics and the citation histograms take their
+                # intermediate results from 'get'
+                model.generate_data()
+            self.results[model_class] = model.results
+
+    def get(self, name):
+        """
+        Returns the intermediate result 'name' (see models.INTERMEDIATES)
+        for the 'statistics' and 'citation_histograms', from the running state
+        """
+        if name not in self._intermediates:
+            self._intermediates[name] = getattr(self, '_' + name)()
+        return self._intermediates[name]
+
+    def _statistics(self):
+        import models
+        table = {'publications': self.publications}
+        for column in self.values:
+            stats = table[column] = {}
+            for prefix in ('', 'refereed_'):
+                counts = self.counts[(column, prefix)]
+                stats[prefix + 'number'] = len(counts)
+                stats[prefix + 'normalized'] = np.float64(self.normalized[(column, prefix)])
+                with np.errstate(invalid='ignore'):
+                    stats[prefix + 'mean'] = np.float64(counts.total)/len(counts)
+                stats[prefix + 'median'] = counts.median()
+                stats[prefix + 'total'] = counts.total
+        return table
+
+    def _citation_histograms(self):
+        today = datetime.today()
+        bins = np.arange(self.min_year, today.year+2)
+        Nbins = max(len(bins) - 1, 0)
+        self.cit_counts = grow(self.cit_counts, Nbins + 1)
+        self.cit_weights = grow(self.cit_weights, len(self.cit_counts))
+        counts = self.cit_counts[:Nbins].copy()
+        weights = self.cit_weights[:Nbins].copy()
+        # like numpy.histogram, the last bin includes its upper edge
+        counts[-1] += self.cit_counts[Nbins]
+        weights[-1] += self.cit_weights[Nbins]
+        # columns: (refereed citation, refereed paper) = 00, 01, 10, 11
+        selections = {
+            'all_citation_histogram': ((0, 1, 2, 3), (1, 3)),
+            'refereed_citation_histogram': ((2, 3), (3,)),
+            'non_refereed_citation_histogram': ((0, 1), (1,)),
+        }
+        histograms = {}
+        for name, (groups, refereed_groups) in selections.items():
+            groups, refereed_groups = list(groups), list(refereed_groups)
+            histograms[name] = ((counts[:,groups].sum(axis=1), bins),
+                                (counts[:,refereed_groups].sum(axis=1), bins),
+                                (weights[:,groups].sum(axis=1), bins),
+                                (weights[:,refereed_groups].sum(axis=1), bins))
+        return histograms
+
+    def _metrics(self, model, prefix):
+        counts = self.counts[('citations', prefix)]
+        h, g, i10 = counts.indices()
+        tori = sum(self.tori_sums[prefix]) if self.tori_counts[prefix] else 0
+        model.h_index = h
+        model.g_index = g
+        model.m_index = float(h)/float(self.time_span)
+        model.i10_index = i10
+        model.e_index = np.sqrt(np.int64(counts.top(h) - h*h))
+        model.tori = tori
+        model.riq = int(1000.0*math.sqrt(float(tori))/float(self.time_span))
+        model.post_process()
+
+    def _reads_histogram(self, model):
+        today = datetime.today()
+        bins = np.arange(READS_START_YEAR, today.year+2)
+        Nbins = len(bins) - 1
+        self.reads_counts = grow(self.reads_counts, Nbins + 1)
+        self.reads_weights = grow(self.reads_weights, len(self.reads_counts))
+        counts = self.reads_counts[:Nbins].copy()
+        weights = self.reads_weights[:Nbins].copy()
+        # like numpy.histogram, the last bin includes its upper edge
+        counts[-1] += self.reads_counts[Nbins]
+        weights[-1] += self.reads_weights[Nbins]
+        if counts.any():
+            model.value_histogram = (counts[:,0], bins)
+            model.refereed_value_histogram = (counts[:,1], bins)
+            model.normalized_value_histogram = (weights[:,0], bins)
+            model.refereed_normalized_value_histogram = (weights[:,1], bins)
+        else:
+            model.value_histogram = False
+            model.results[str(today.year)] = "0:0:0:0"
+        model.post_process()
+
+    def _series(self, model):
+        today = datetime.today()
+        self._extend_series(today.year)
+        model.series = {}
+        Ntori = 0
+        tori_total = (0.0, 0.0)
+        for year in range(self.min_year, today.year+1):
+            i = year - self.min_year
+            Ntori += self.series_tori_counts[i]
+            for value in self.series_tori_sums[i]:
+                tori_total = compensated_sum(tori_total, value)
+            tori = sum(tori_total) if Ntori else 0
+            h, g, i10 = self.series[i].indices()
+            TimeSpan = year - self.min_year + 1
+            m = float(h)/float(TimeSpan)
+            roq = int(1000.0*math.sqrt(float(tori))/float(TimeSpan))
+            model.series[str(year)] = "%s:%s:%s:%s:%s:%s" % (h,g,i10,tori,m,roq)
+        model.post_process()
+
+    def generate(self, fmt=''):
+        """
+        Returns the current results, formatted like those of 'generate'
+        """
+        results = format_results([self.results[m] for m in self.model_classes])
+        if fmt == 'legacy':
+            return legacy_format(results)
+        return results
@@ -0,0 +1,125 @@
+import time
+import logging
+import threading
+import cProfile
+import pstats
+import StringIO
+from contextlib import contextmanager
+# metrics specific modules
+from config import config
+
+logger = logging.getLogger('adsstats')
+
+class Recorder(object):
+    """
+    The timings (seconds per stage) and counters of one request. Stages
+    and counters are recorded in the thread handling the request and in
+    the I/O threads working for it (see 'engine.IOEngine').
+    """
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+        self.profile = None
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        with self._lock:
+            report = {'timings': dict(self.timings), 'counters': dict(self.counters)}
+        if self.profile is not None:
+            report['profile'] = self.profile
+        return report
+
+_local = threading.local()
+
+def current():
+    """
+    Returns the recorder of the request handled by this thread (or None)
+    """
+    return getattr(_local, 'recorder', None)
+
+def activate(recorder):
+    """
+    Make 'recorder' the recorder for this thread; returns the previous one
+    """
+    previous = current()
+    _local.recorder = recorder
+    return previous
+
+@contextmanager
+def stage(name):
+    """
+    Times the enclosed block as stage 'name' of the current request
+    """
+    stime = time.time()
+    try:
+        yield
+    finally:
+        duration = time.time() - stime
+        recorder = current()
+        if recorder is not None:
+            recorder.add_time(name, duration)
+        logger.debug('%s: %.4f sec', name, duration)
+
+def count(name, n=1):
+    """
+    Increments counter 'name' of the current request
+    """
+    recorder = current()
+    if recorder is not None:
+        recorder.count(name, n)
+
+# Exporters are called with the name and the report of every finished
+# request, e.g. to send the timings and counters to a metrics system
+_exporters = []
+
+def add_exporter(exporter):
+    _exporters.append(exporter)
+
+def remove_exporter(exporter):
+    _exporters.remove(exporter)
+
+@contextmanager
+def request(name, profile=None):
+    """
+    Records the enclosed block as a request: its stages and counters
+    are collected in a new recorder, which is passed to the exporters
+    at the end. With 'profile' (default: METRICS_PROFILE) the thread
+    handling the request runs under cProfile and the report gets the
+    top of the profile.
+    """
+    if profile is None:
+        profile = config.METRICS_PROFILE
+    recorder = Recorder()
+    previous = activate(recorder)
+    profiler = None
+    if profile:
+        profiler = cProfile.Profile()
+    try:
+        with stage(name):
+            if profiler is not None:
+                profiler.enable()
+            try:
+                yield recorder
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+    finally:
+        activate(previous)
+        if profiler is not None:
+            output = StringIO.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(config.METRICS_PROFILE_LINES)
+            recorder.profile = output.getvalue()
+        report = recorder.report()
+        for exporter in list(_exporters):
+            try:
+                exporter(name, report)
+            except:
+                logger.exception('Exporter %s failed', exporter)
@@ -0,0 +1,183 @@
+import threading
+from array import array
+import numpy as np
+# metrics specific modules
+from config import config
+from adsstats.attributes import AttributeStore, csr_offsets, csr_take
+
+# the link files used by the offline backend
+LINK_FILE_TYPES = ('citations', 'references', 'refereed', 'reads', 'downloads')
+
+def link_files():
+    """
+    Returns the paths of the link files: the entries in MONGO_DATA_COLLECTIONS,
+    updated with METRICS_LINK_FILES. The optional 'authors' file
+    (bibcode, number of authors) is not part of the ADS link files.
+    """
+    files = dict((k,v) for (k,v) in config.MONGO_DATA_COLLECTIONS.items() if k in LINK_FILE_TYPES)
+    files.update(config.METRICS_LINK_FILES)
+    return files
+
+def read_fields(filename):
+    """
+    Yields the fields on every line of a link file. Fields are separated
+    by white space; lists of values may also be comma separated.
+    """
+    with open(filename) as f:
+        for line in f:
+            fields = line.replace(',', ' ').split()
+            if fields:
+                yield fields
+
+class LinkGraph(object):
+    """
+    In-memory citation graph built from the ADS link files. Every bibcode
+    gets an integer id; the per-paper data are arrays indexed on these ids:
+
+        year            publication year
+        refereed_bits   refereed flags, packed in a bitset
+        ref_counts      number of references
+        authors         number of authors (1 if not known)
+
+    The citations (citing paper ids) and the yearly reads and downloads
+    are stored in CSR form, like in 'attributes.AttributeStore'.
+    """
+    def __init__(self, files=None):
+        if files is None:
+            files = link_files()
+        self.ids = {}
+        self.bibcodes = []
+        # citations: (cited, citing) id pairs
+        cited = array('l')
+        citing = array('l')
+        for fields in read_fields(files['citations']):
+            cited.append(self.get_id(fields[0]))
+            citing.append(self.get_id(fields[1]))
+        references = array('l')
+        if files.get('references'):
+            for fields in read_fields(files['references']):
+                references.append(self.get_id(fields[0]))
+        refereed = array('l')
+        if files.get('refereed'):
+            for fields in read_fields(files['refereed']):
+                refereed.append(self.get_id(fields[0]))
+        reads = self._read_series(files.get('reads'))
+        downloads = self._read_series(files.get('downloads'))
+        authors = {}
+        if files.get('authors'):
+            for fields in read_fields(files['authors']):
+                authors[self.get_id(fields[0])] = int(fields[1])
+
+        N = len(self.bibcodes)
+        self.year = np.array([int(b[:4]) for b in self.bibcodes], dtype=np.int16)
+        cited = np.frombuffer(cited, dtype=np.int_).astype(np.int64)
+        citing = np.frombuffer(citing, dtype=np.int_).astype(np.int64)
+        order = np.argsort(cited, kind='mergesort')
+        self.cit_offsets = csr_offsets(np.bincount(cited, minlength=N))
+        self.cit_ids = citing[order]
+        if len(references):
+            self.ref_counts = np.bincount(np.frombuffer(references, dtype=np.int_),
+                                          minlength=N).astype(np.int32)
+        else:
+            # without a references file, count the citations given
+            self.ref_counts = np.bincount(citing, minlength=N).astype(np.int32)
+        flags = np.zeros(N, dtype=bool)
+        flags[np.frombuffer(refereed, dtype=np.int_)] = True
+        self.refereed_bits = np.packbits(flags)
+        self.authors = np.ones(N, dtype=np.int32)
+        for (i, Nauthors) in authors.items():
+            self.authors[i] = max(1, Nauthors)
+        self.reads_offsets, self.reads_values = self._series_csr(reads, N)
+        self.downloads_offsets, self.downloads_values = self._series_csr(downloads, N)
+
+    def get_id(self, bibcode):
+        try:
+            return self.ids[bibcode]
+        except KeyError:
+            self.ids[bibcode] = len(self.bibcodes)
+            self.bibcodes.append(bibcode)
+            return self.ids[bibcode]
+
+    def _read_series(self, filename):
+        series = {}
+        if filename:
+            for fields in read_fields(filename):
+                series[self.get_id(fields[0])] = map(int, fields[1:])
+        return series
+
+    def _series_csr(self, series, N):
+        lengths = np.zeros(N, dtype=np.int64)
+        for (i, values) in series.items():
+            lengths[i] = len(values)
+        offsets = csr_offsets(lengths)
+        values = np.zeros(offsets[-1], dtype=np.int32)
+        for (i, v) in series.items():
+            values[offsets[i]:offsets[i+1]] = v
+        return offsets, values
+
+    def __len__(self):
+        return len(self.bibcodes)
+
+    def is_refereed(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        return ((self.refereed_bits[ids >> 3] >> (7 - (ids & 7))) & 1).astype(bool)
+
+    def lookup(self, bibcodes):
+        """
+        Returns the ids of the known bibcodes in 'bibcodes', in the order
+        given (duplicates are skipped)
+        """
+        index = []
+        seen = set()
+        for bibcode in bibcodes:
+            i = self.ids.get(bibcode)
+            if i is not None and i not in seen:
+                seen.add(i)
+                index.append(i)
+        return np.array(index, dtype=np.int64)
+
+    def attributes(self, bibcodes):
+        """
+        Returns the attribute store for the known bibcodes in 'bibcodes',
+        in the order given (duplicates are skipped)
+        """
+        index = self.lookup(bibcodes)
+        cit_offsets, cit_pos = csr_take(self.cit_offsets, index)
+        citing = self.cit_ids[cit_pos]
+        reads_offsets, reads_pos = csr_take(self.reads_offsets, index)
+        reads_values = self.reads_values[reads_pos]
+        downloads_offsets, downloads_pos = csr_take(self.downloads_offsets, index)
+        return AttributeStore([str(self.bibcodes[i]) for i in index],
+                              self.is_refereed(index), self.authors[index],
+                              segment_sums(reads_offsets, reads_values),
+                              segment_sums(downloads_offsets, self.downloads_values[downloads_pos]),
+                              reads_offsets, reads_values,
+                              cit_offsets, self.year[citing],
+                              self.ref_counts[citing], self.is_refereed(citing))
+
+def segment_sums(offsets, values):
+    """
+    Returns the sum of the values of every row of a CSR structure
+    """
+    totals = np.zeros(len(values)+1, dtype=np.int64)
+    np.cumsum(values, out=totals[1:])
+    return totals[offsets[1:]] - totals[offsets[:-1]]
+
+_graph = None
+_graph_lock = threading.Lock()
+
+def get_link_graph():
+    """
+    Returns the citation graph. It is opened from the snapshot in
+    METRICS_SNAPSHOT_PATH (see 'snapshot.py') if set, and loaded from
+    the link files otherwise, the first time it is needed.
+    """
+    global _graph
+    with _graph_lock:
+        if _graph is None:
+            if config.METRICS_SNAPSHOT_PATH:
+                from adsstats.snapshot import Snapshot
+                _graph = Snapshot(config.METRICS_SNAPSHOT_PATH)
+            else:
+                _graph = LinkGraph()
+        return _graph
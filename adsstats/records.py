@@ -0,0 +1,141 @@
+from array import array
+import numpy as np
+# metrics specific modules
+from adsstats.attributes import csr_offsets, csr_take
+
+# name, array typecode and NumPy type of the record columns
+COLUMNS = (('citing', 'i', np.int32),
+           ('cited', 'i', np.int32),
+           ('year', 'h', np.int16),
+           ('refs', 'i', np.int32),
+           ('authors', 'i', np.int32),
+           ('refereed', 'b', np.bool_))
+
+class CitationRecords(object):
+    """
+    Compact store of citation records. Bibcodes are interned: 'bibcodes'
+    holds every bibcode once and 'ids' maps a bibcode to its position in
+    it. The records are kept in typed arrays, one entry per citation:
+
+        citing      id of the citing paper
+        cited       id of the cited paper
+        year        publication year of the citing paper
+        refs        number of references of the citing paper
+        authors     number of authors of the cited paper
+        refereed    refereed flag of the citing paper
+
+    which takes about 20 bytes per citation (plus the citing bibcode,
+    once). The refereed and non-refereed citations are selected with
+    masks over the same records (see 'mask').
+    """
+    def __init__(self):
+        self.bibcodes = []
+        self.ids = {}
+        for (name, typecode, dtype) in COLUMNS:
+            setattr(self, name, array(typecode))
+
+    def __len__(self):
+        return len(self.citing)
+
+    def intern(self, bibcode):
+        """
+        Returns the id of 'bibcode', adding it when it is new
+        """
+        id = self.ids.get(bibcode)
+        if id is None:
+            id = self.ids[bibcode] = len(self.bibcodes)
+            self.bibcodes.append(bibcode)
+        return id
+
+    def add(self, citing, cited, refs, authors, refereed):
+        """
+        Adds the citation of paper 'cited' by paper 'citing' (bibcodes)
+        """
+        self.citing.append(self.intern(citing))
+        self.cited.append(self.intern(cited))
+        self.year.append(int(citing[:4]))
+        self.refs.append(refs)
+        self.authors.append(authors)
+        self.refereed.append(refereed)
+
+    def column(self, name):
+        """
+        Returns column 'name' as a NumPy array (a copy)
+        """
+        for (column, typecode, dtype) in COLUMNS:
+            if column == name:
+                return np.frombuffer(getattr(self, name), dtype=dtype).copy()
+        raise KeyError(name)
+
+    def mask(self, refereed=True):
+        """
+        Returns the mask of the refereed (or the non-refereed) citations
+        """
+        mask = self.column('refereed')
+        if refereed:
+            return mask
+        return ~mask
+
+    def extend(self, other):
+        """
+        Adds the records of the store 'other', with its bibcodes
+        interned in this store
+        """
+        mapping = np.array([self.intern(b) for b in other.bibcodes], dtype=np.int32)
+        for (name, typecode, dtype) in COLUMNS:
+            values = other.column(name)
+            if name in ('citing', 'cited'):
+                values = mapping[values]
+            getattr(self, name).fromstring(values.astype(dtype).tostring())
+
+    def take(self, index):
+        """
+        Returns a new store with the records at the positions 'index'
+        """
+        index = np.asarray(index, dtype=np.int64)
+        records = CitationRecords()
+        columns = dict((name, self.column(name)[index]) for (name, typecode, dtype) in COLUMNS)
+        used = np.union1d(columns['citing'], columns['cited'])
+        records.bibcodes = [self.bibcodes[i] for i in used]
+        records.ids = dict((b, i) for (i, b) in enumerate(records.bibcodes))
+        for (name, typecode, dtype) in COLUMNS:
+            values = columns[name]
+            if name in ('citing', 'cited'):
+                values = np.searchsorted(used, values)
+            setattr(records, name, array(typecode, values.astype(dtype).tostring()))
+        return records
+
+    def select(self, bibcodes):
+        """
+        Returns a new store with the citations of the papers 'bibcodes'
+        """
+        cited = [self.ids[b] for b in bibcodes if b in self.ids]
+        return self.take(np.flatnonzero(np.in1d(self.column('cited'), cited)))
+
+    def group(self, bibcodes):
+        """
+        Returns the CSR offsets and record positions of the citations of
+        the papers 'bibcodes': the citations of paper i are the records at
+        positions[offsets[i]:offsets[i+1]], in the order they were added
+        """
+        cited = self.column('cited')
+        Nids = len(self.bibcodes)
+        order = np.argsort(cited, kind='mergesort')
+        # papers without citations are mapped to the empty row Nids
+        offsets = csr_offsets(np.bincount(cited, minlength=Nids+1))
+        index = np.array([self.ids.get(b, Nids) for b in bibcodes], dtype=np.int64)
+        offsets, positions = csr_take(offsets, index)
+        return offsets, order[positions]
+
+    # pickled (for the data cache) as strings instead of lists of numbers
+    def __getstate__(self):
+        state = {'bibcodes': self.bibcodes}
+        for (name, typecode, dtype) in COLUMNS:
+            state[name] = getattr(self, name).tostring()
+        return state
+
+    def __setstate__(self, state):
+        self.bibcodes = state['bibcodes']
+        self.ids = dict((b, i) for (i, b) in enumerate(self.bibcodes))
+        for (name, typecode, dtype) in COLUMNS:
+            setattr(self, name, array(typecode, state[name]))
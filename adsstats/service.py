@@ -0,0 +1,369 @@
+"""
+Long running HTTP/JSON service for the metrics.
+
+    POST /metrics   {"bibcodes": [...], "types": "...", "fmt": "..."}
+                    (or {"query": "..."}); returns the results of 'generate'
+    GET  /stats     throughput, latency and batching statistics, together
+                    with the executor, HTTP pool and cache statistics
+    GET  /ping      health check of the worker pools (503 when unhealthy)
+
+The service keeps the worker pools, the HTTP connection pools, the caches
+and the imported models warm between requests. Requests for bibcodes that
+arrive within METRICS_BATCH_WINDOW seconds of each other are coalesced:
+the data for all of them are fetched once (see 'stats_utils.generate_many').
+
+    python -m adsstats.service --port 8080
+    python -m adsstats.service --standin 1000
+
+The second form serves a synthetic corpus through local stand-ins for
+Solr and adsdata (see 'benchmarks'), to run and test the service locally.
+"""
+import sys
+import time
+import Queue
+import argparse
+import threading
+import BaseHTTPServer
+import SocketServer
+from functools import partial
+from collections import deque
+from multiprocessing.pool import ThreadPool
+import simplejson as json
+# metrics specific modules
+from config import config
+from adsstats import stats_utils
+from adsstats.cache import get_result_cache, cache_stats, result_cache_stats
+from adsstats.client import http_stats
+from adsstats.engine import get_executor, shutdown_executor, executor_health
+from adsstats.instrument import logger, request
+
+class Pending(object):
+    """
+    A request waiting in the batcher for its results
+    """
+    def __init__(self, args):
+        self.args = args
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+class Batcher(object):
+    """
+    Collects requests into batches: a batch is closed 'window' seconds
+    after its first request arrived, or when it has 'max_size' requests.
+    Batches are run on a pool of 'workers' threads; requests for bibcodes
+    with the same types and format share one fetch.
+    """
+    def __init__(self, window=None, max_size=None, workers=None):
+        if window is None:
+            window = config.METRICS_BATCH_WINDOW
+        if max_size is None:
+            max_size = config.METRICS_BATCH_MAX
+        if workers is None:
+            workers = config.METRICS_SERVICE_WORKERS
+        self.window = window
+        self.max_size = max_size
+        self.queue = Queue.Queue()
+        self.pool = ThreadPool(workers)
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.batched_requests = 0
+        self.thread = threading.Thread(target=self._dispatch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, args):
+        """
+        Queue the request 'args' and wait for its results
+        """
+        pending = Pending(args)
+        self.queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error[0], pending.error[1], pending.error[2]
+        return pending.results
+
+    def _dispatch(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.window
+            while len(batch) < self.max_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except Queue.Empty:
+                    break
+            with self._lock:
+                self.batches += 1
+                self.batched_requests += len(batch)
+            self.pool.apply_async(self._run, (batch,))
+
+    def _run(self, batch):
+        error = None
+        try:
+            groups = {}
+            for pending in batch:
+                if 'bibcodes' in pending.args:
+                    key = (pending.args.get('types'), pending.args.get('fmt',''))
+                    groups.setdefault(key, []).append(pending)
+                else:
+                    self._finish([pending], partial(stats_utils.compute_results, pending.args), single=True)
+            for ((types, fmt), group) in groups.items():
+                self._run_group(group, types, fmt)
+        except:
+            logger.exception('Batch of %s requests failed', len(batch))
+            error = sys.exc_info()
+        finally:
+            # every request gets an answer, whatever went wrong
+            for pending in batch:
+                if not pending.done.is_set():
+                    pending.error = error or (RuntimeError, RuntimeError('The request was not completed'), None)
+                    pending.done.set()
+
+    def _run_group(self, group, types, fmt):
+        """
+        Run the requests for bibcodes in 'group' (with the same types and
+        format) with one fetch; when that fails, they are run one by one,
+        so that only the requests that fail on their own get an error
+        """
+        args = {'fmt': fmt}
+        if types:
+            args['types'] = types
+        def compute(group):
+            sets = dict((i, p.args['bibcodes']) for (i, p) in enumerate(group))
+            with request('batch'):
+                results = stats_utils.compute_many(sets, args)
+            return [results[i] for i in range(len(group))]
+        if len(group) == 1:
+            return self._finish(group, partial(compute, group))
+        try:
+            results = compute(group)
+        except:
+            logger.exception('Batch of %s requests failed, running them one by one', len(group))
+            for pending in group:
+                self._finish([pending], partial(compute, [pending]))
+            return
+        self._finish(group, lambda: results)
+
+    def _finish(self, group, compute, single=False):
+        """
+        Set the results of the requests in 'group' from 'compute()', which
+        returns a list with the results of every request ('single': the
+        results of the one request). Results with an 'error' (see
+        'stats_utils.compute_many') become the error of their request.
+        """
+        try:
+            results = compute()
+            if single:
+                results = [results]
+            for (pending, result) in zip(group, results):
+                if isinstance(result, dict) and 'error' in result:
+                    pending.error = (ValueError, ValueError(result['error']), None)
+                else:
+                    pending.results = result
+        except:
+            logger.exception('Batch of %s requests failed', len(group))
+            for pending in group:
+                pending.error = sys.exc_info()
+        for pending in group:
+            pending.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {'batches': self.batches,
+                    'batched_requests': self.batched_requests,
+                    'queued': self.queue.qsize()}
+
+class MetricsService(object):
+    """
+    The state of the service: the batcher and the request statistics
+    """
+    def __init__(self):
+        # load the models (and NumPy) before the first request
+        import models
+        models.get_registry()
+        # and start the worker pools
+        get_executor()
+        self.batcher = Batcher()
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.latencies = deque(maxlen=config.METRICS_SERVICE_LATENCY_WINDOW)
+
+    def generate(self, args):
+        with self._lock:
+            self.in_flight += 1
+        stime = time.time()
+        try:
+            cache = get_result_cache()
+            if cache is None:
+                return self.batcher.submit(args)
+            return cache.get(args, self.batcher.submit)
+        except:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.requests += 1
+                self.latencies.append(time.time() - stime)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            uptime = time.time() - self.started
+            stats = {'requests': self.requests,
+                     'errors': self.errors,
+                     'in_flight': self.in_flight,
+                     'uptime': uptime,
+                     'throughput': self.requests/uptime}
+        if latencies:
+            stats['latency'] = {'mean': sum(latencies)/len(latencies),
+                                'p50': percentile(latencies, 50),
+                                'p90': percentile(latencies, 90),
+                                'p99': percentile(latencies, 99),
+                                'max': latencies[-1]}
+        stats['batching'] = self.batcher.stats()
+        stats['executor'] = get_executor().stats()
+        stats['http'] = http_stats()
+        stats['cache'] = cache_stats()
+        stats['result_cache'] = result_cache_stats()
+        return stats
+
+def check_request(args):
+    """
+    Returns what is wrong with the request 'args', or None
+    """
+    if 'bibcodes' in args:
+        bibcodes = args['bibcodes']
+        if not isinstance(bibcodes, list) or not all(isinstance(b, basestring) for b in bibcodes):
+            return 'bibcodes must be a list of strings'
+        if not bibcodes:
+            return 'bibcodes must not be empty'
+    elif 'query' in args:
+        if not isinstance(args['query'], basestring):
+            return 'query must be a string'
+    else:
+        return 'Either bibcodes or a query is required'
+    for name in ('types', 'fmt'):
+        if name in args and not isinstance(args[name], basestring):
+            return '%s must be a string' % name
+    return None
+
+def percentile(values, p):
+    """
+    Returns percentile 'p' of the sorted list 'values'
+    """
+    return values[min(len(values)-1, int(len(values)*p/100.0))]
+
+def numpy_value(value):
+    """
+    JSON encoding of the NumPy scalars in the results
+    """
+    try:
+        return value.item()
+    except AttributeError:
+        raise TypeError('%r is not JSON serializable' % (value,))
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, code, doc):
+        body = json.dumps(doc, default=numpy_value)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send_json(200, self.server.service.stats())
+        elif self.path == '/ping':
+            health = executor_health()
+            if health['ok']:
+                self.send_json(200, {'status': 'ok', 'executor': health})
+            else:
+                self.send_json(503, {'status': 'unhealthy', 'executor': health})
+        else:
+            self.send_json(404, {'error': 'Unknown path %s' % self.path})
+
+    def do_POST(self):
+        if self.path != '/metrics':
+            return self.send_json(404, {'error': 'Unknown path %s' % self.path})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            args = json.loads(self.rfile.read(length))
+            args = dict((str(k), v) for (k, v) in args.items())
+        except:
+            return self.send_json(400, {'error': 'The request body must be a JSON object'})
+        error = check_request(args)
+        if error is not None:
+            return self.send_json(400, {'error': error})
+        try:
+            results = self.server.service.generate(args)
+        except Exception as e:
+            return self.send_json(500, {'error': str(e)})
+        self.send_json(200, results)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def make_server(host=None, port=None):
+    """
+    Returns the HTTP server for the service; port 0 picks a free port
+    """
+    if host is None:
+        host = config.METRICS_SERVICE_HOST
+    if port is None:
+        port = config.METRICS_SERVICE_PORT
+    server = Server((host, port), Handler)
+    server.service = MetricsService()
+    return server
+
+def use_standins(papers):
+    """
+    Serve a synthetic corpus of 'papers' publications through local
+    stand-ins for Solr and adsdata; returns the bibcodes of the corpus
+    """
+    from benchmarks.corpus import Corpus
+    from benchmarks.standins import SolrStandin, AdsdataStandin
+    corpus = Corpus(papers=papers)
+    solr = SolrStandin(corpus.solr_docs)
+    config.SOLR_URL = solr.url
+    config.METRICS_BACKEND = 'solr'
+    stats_utils._session = AdsdataStandin(corpus.mongo_docs)
+    return corpus.bibcodes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the metrics service')
+    parser.add_argument('--host', default=config.METRICS_SERVICE_HOST)
+    parser.add_argument('--port', type=int, default=config.METRICS_SERVICE_PORT)
+    parser.add_argument('--standin', type=int, metavar='PAPERS',
+                        help='serve a synthetic corpus with local Solr and adsdata stand-ins')
+    args = parser.parse_args(argv)
+    import logging
+    logging.basicConfig(level=logging.INFO)
+    if args.standin:
+        bibcodes = use_standins(args.standin)
+        logger.info('Serving a synthetic corpus, e.g. {"bibcodes": %s}', json.dumps(bibcodes[:3]))
+    server = make_server(args.host, args.port)
+    logger.info('Metrics service on http://%s:%s', *server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    shutdown_executor()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,116 @@
+"""
+Binary snapshot of the citation graph in the ADS link files.
+
+A snapshot is a directory with one NumPy (.npy) file per array and a
+'meta.json' file with the format version and sizes. The bibcodes are
+stored sorted, so a paper's id is its position in the 'bibcodes' array
+and bibcodes are looked up with a binary search. All arrays are opened
+memory mapped: opening is near instant and worker processes share one
+copy of the data in the page cache.
+
+A snapshot is built from the link files with
+
+    python -m adsstats.snapshot <directory>
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import simplejson as json
+import numpy as np
+# metrics specific modules
+from adsstats.attributes import csr_take
+from adsstats.links import LinkGraph, LINK_FILE_TYPES, link_files
+
+SNAPSHOT_VERSION = 1
+ARRAYS = ('bibcodes', 'year', 'refereed_bits', 'ref_counts', 'authors',
+          'cit_offsets', 'cit_ids', 'reads_offsets', 'reads_values',
+          'downloads_offsets', 'downloads_values')
+
+def write_snapshot(graph, path):
+    """
+    Write the citation graph 'graph' as a snapshot in the directory 'path'.
+    The snapshot is written next to 'path' first and then moved in place.
+    """
+    bibcodes = np.array(graph.bibcodes, dtype='S')
+    # ids are re-assigned in the sorted order of the bibcodes
+    order = np.argsort(bibcodes, kind='mergesort')
+    new_id = np.empty(len(order), dtype=np.int64)
+    new_id[order] = np.arange(len(order), dtype=np.int64)
+    cit_offsets, cit_pos = csr_take(graph.cit_offsets, order)
+    reads_offsets, reads_pos = csr_take(graph.reads_offsets, order)
+    downloads_offsets, downloads_pos = csr_take(graph.downloads_offsets, order)
+    arrays = {'bibcodes': bibcodes[order],
+              'year': graph.year[order],
+              'refereed_bits': np.packbits(graph.is_refereed(order)),
+              'ref_counts': graph.ref_counts[order],
+              'authors': graph.authors[order],
+              'cit_offsets': cit_offsets,
+              'cit_ids': new_id[graph.cit_ids[cit_pos]],
+              'reads_offsets': reads_offsets,
+              'reads_values': graph.reads_values[reads_pos],
+              'downloads_offsets': downloads_offsets,
+              'downloads_values': graph.downloads_values[downloads_pos]}
+    tmp_path = path.rstrip('/') + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for name in ARRAYS:
+        np.save(os.path.join(tmp_path, name + '.npy'), arrays[name])
+    meta = {'version': SNAPSHOT_VERSION,
+            'papers': len(order),
+            'citations': len(arrays['cit_ids']),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+class Snapshot(LinkGraph):
+    """
+    Citation graph opened (memory mapped, read only) from a snapshot
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != SNAPSHOT_VERSION:
+            raise ValueError('Snapshot %s has version %s, expected %s' % (
+                path, self.meta.get('version'), SNAPSHOT_VERSION))
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+
+    def lookup(self, bibcodes):
+        if not len(bibcodes):
+            return np.zeros(0, dtype=np.int64)
+        bibcodes = np.array(bibcodes, dtype='S')
+        index = np.searchsorted(self.bibcodes, bibcodes)
+        index[index == len(self.bibcodes)] = 0
+        found = np.asarray(self.bibcodes[index]) == bibcodes
+        # skip unknown bibcodes and duplicates, keeping the order given
+        index = index[found]
+        _, first = np.unique(index, return_index=True)
+        return index[np.sort(first)].astype(np.int64)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build a binary snapshot of the ADS link files')
+    parser.add_argument('path', help='directory for the snapshot')
+    for name in LINK_FILE_TYPES + ('authors',):
+        parser.add_argument('--%s' % name, help='%s file (default: from the config)' % name)
+    args = parser.parse_args(argv)
+    files = link_files()
+    for name in LINK_FILE_TYPES + ('authors',):
+        if getattr(args, name):
+            files[name] = getattr(args, name)
+    stime = time.time()
+    print "Loading the link files"
+    graph = LinkGraph(files)
+    print "  %s papers, %s citations (%s sec)" % (len(graph), len(graph.cit_ids), time.time() - stime)
+    stime = time.time()
+    print "Writing snapshot to %s" % args.path
+    write_snapshot(graph, args.path)
+    print "  duration: %s sec" % (time.time() - stime)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
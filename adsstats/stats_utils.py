@@ -1,239 +1,336 @@
 # general modules
-import os
-import time
-import sys
 import site
 import urllib
-import requests
+import threading
 import simplejson as json
-from multiprocessing import Pool, current_process
-from multiprocessing import Manager
-# module for retrieving data from MongoDB
-site.addsitedir('/proj/adsx/adsdata')
-import adsdata
+from functools import partial
 # metrics specific modules
 from config import config
 from adsstats import utils
-import models
-# initiate MongoDB session
-session = adsdata.get_session()
-# memory mapped data
-manager = Manager()
-publicationlist = manager.list()
-publication_data= manager.list([])
-ads_data = manager.dict()
-pub_dict = manager.dict()
-glob_data= manager.list([])
-# for citation dictionary function
-cit_dict = manager.dict()
-ref_cit_dict = manager.dict()
-non_ref_cit_dict = manager.dict()
-# some global variables
-global citation_dictionary
-citation_dictionary = {}
-global refereed_citation_dictionary
-refereed_citation_dictionary = {}
-global non_refereed_citation_dictionary
-non_refereed_citation_dictionary = {}
+from adsstats.client import get_client
+from adsstats.engine import IOEngine, get_executor
+from adsstats.cache import get_cache
+from adsstats.instrument import logger, stage, count, request
+# The MongoDB session and the models (which pull in NumPy) are only
+# created when they are first needed, so that importing this module
+# has no side effects and works when MongoDB is not reachable
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            # module for retrieving data from MongoDB
+            site.addsitedir(config.METRICS_ADSDATA_PATH)
+            import adsdata
+            _session = adsdata.get_session()
+        return _session
+
 # Definition of functions for data retrieval and processing
 # A. Functions for re-arranging data structures
 #    we data key'ed on bibcode
-def merge_publications(dict):
-    pub_dict[dict['bibcode']] = dict
-    publicationlist.append(dict['bibcode'])
+class PublicationData(object):
+    """
+    Plain, in-process container for the data gathered for one request.
+    The fetch functions return their results and these are merged in here
+    by the thread that drives the I/O engine.
+    """
+    def __init__(self):
+        from adsstats.records import CitationRecords
+        self.publicationlist = []
+        self.pub_dict = {}
+        self.ads_data = {}
+        # the citations, and the bibcodes whose citations are in there
+        self.citations = CitationRecords()
+        self.cited = set()
 
-def get_citation_dictionary(bibcode):
-    fl = 'bibcode,property,reference'
-    papers = []
-    q = 'citations(bibcode:%s)' % bibcode
-    rsp = req(config.SOLR_URL, q=q, fl=fl, rows=config.MAX_HITS)
-    cit_dict[bibcode] = []
-    ref_cit_dict[bibcode] = []
-    non_ref_cit_dict[bibcode] = []
-    cits = []
-    ref_cits = []
-    non_ref_cits = []
-    try:
-        Nauths = max(1,len(pub_dict[bibcode]['author_norm']))
-    except:
-        Nauths = 1
-    pubyear = int(bibcode[:4])
-    for doc in rsp['response']['docs']:
-        try:
-            Nrefs = len(doc['reference'])
-        except:
-            Nrefs = 0
-        cits.append((doc['bibcode'],Nrefs,Nauths,pubyear))
-        if 'REFEREED' in doc['property']:
-            ref_cits.append((doc['bibcode'],Nrefs,Nauths,pubyear))
-        else:
-            non_ref_cits.append((doc['bibcode'],Nrefs,Nauths,pubyear))
-    cit_dict[bibcode] = cits
-    ref_cit_dict[bibcode] = ref_cits
-    non_ref_cit_dict[bibcode] = non_ref_cits
+def merge_publications(data, engine, pubdata):
+    """
+    Merge the publication data for a chunk and immediately schedule
+    the citation and MongoDB fetches for that chunk
+    """
+    pubs = {}
+    for doc in pubdata:
+        data.pub_dict[doc['bibcode']] = doc
+        data.publicationlist.append(doc['bibcode'])
+        pubs[doc['bibcode']] = doc
+    biblist = map(lambda a: a['bibcode'], pubdata)
+    if biblist:
+        engine.submit(get_citation_records, biblist, pubs,
+                      callback=partial(merge_citations, data, biblist))
+    for batch in utils.chunks(biblist, config.METRICS_MONGO_BATCH_SIZE):
+        engine.submit(get_mongo_data, batch,
+                      callback=partial(merge_mongo_data, data))
+
+def merge_citations(data, biblist, records):
+    # the citations of a bibcode that was in several chunks are only
+    # merged once
+    new = [bibcode for bibcode in biblist if bibcode not in data.cited]
+    if len(new) < len(biblist):
+        records = records.select(new)
+    data.cited.update(new)
+    data.citations.extend(records)
+
+def merge_mongo_data(data, docs):
+    data.ads_data.update(docs)
 
 # B. Data gathering functions
 def req(url, **kwargs):
     kwargs['wt'] = 'json'
     query_params = urllib.urlencode(kwargs)
-    r = requests.get(url, params=query_params)
+    r = get_client().get(url, params=query_params)
+    count('solr_requests')
+    count('solr_bytes', len(r.content))
     return r.json()
 
-def get_mongo_data(bbc):
-    doc = session.get_doc(bbc)
-    try:
-        doc.pop("full", None)
-    except:
-        pass
-    try:
-        ads_data[bbc] = doc
-    except:
-        pass
+def req_pages(url, **kwargs):
+    """
+    Yields the documents for a Solr query one page (METRICS_PAGE_SIZE rows)
+    at a time, using cursor based deep paging. There is no limit on the
+    number of results and only one page is held in memory.
+    """
+    kwargs['rows'] = config.METRICS_PAGE_SIZE
+    kwargs['sort'] = config.METRICS_CURSOR_SORT
+    cursor = '*'
+    while True:
+        rsp = req(url, cursorMark=cursor, **kwargs)
+        docs = rsp['response']['docs']
+        if docs:
+            yield docs
+        next_cursor = rsp.get('nextCursorMark', cursor)
+        if not docs or next_cursor == cursor:
+            break
+        cursor = next_cursor
+
+# The per-bibcode results of the functions below are kept in the data
+# cache (see 'cache.DataCache'), so only bibcodes that are not in the
+# cache cause network I/O
+def get_mongo_data(biblist):
+    """
+    Get the reads and downloads for a batch of bibcodes in one MongoDB
+    query. Only these fields are transferred (no full text or
+    dereferenced fields). Returns a dictionary with a document for every
+    bibcode, which is None for bibcodes not in MongoDB.
+    """
+    cache = get_cache()
+    docs = {}
+    if cache is not None:
+        docs, biblist = cache.get_many('mongo', biblist)
+        if not biblist:
+            return docs
+    collection = get_session().get_collection(config.MONGO_DOCS_COLLECTION)
+    found = dict.fromkeys(biblist)
+    for doc in collection.find({'_id': {'$in': biblist}}, config.METRICS_MONGO_FIELDS):
+        found[doc['_id']] = doc
+        count('mongo_docs')
+    count('mongo_queries')
+    if cache is not None:
+        for (bbc, doc) in found.items():
+            cache.put('mongo', bbc, doc)
+    docs.update(found)
+    return docs
 
 def get_publication_data(biblist):
+    cache = get_cache()
+    docs = []
+    if cache is not None:
+        found, biblist = cache.get_many('publication', biblist)
+        docs = found.values()
+        if not biblist:
+            return docs
     fl = 'bibcode,reference,author_norm,property,read_count'
 #    fl = ''
     list = " OR ".join(map(lambda a: "bibcode:%s"%a, biblist))
     q = '%s' % list
-    rsp = req(config.SOLR_URL, q=q, fl=fl, rows=config.MAX_HITS)
-    publication_data.append(rsp['response']['docs'])
+    rsp = req(config.SOLR_URL, q=q, fl=fl, rows=config.METRICS_MAX_HITS)
+    if cache is not None:
+        for doc in rsp['response']['docs']:
+            cache.put('publication', doc['bibcode'], doc)
+    return docs + rsp['response']['docs']
 
-def get_bibcodes_from_private_library(id):
-    sys.stderr.write('Private libraries are not yet implemented')
-    return []
-# C. Creation of data vectors for stats calculations
-def make_vectors(**args):
-    attr_list = []
-    for bibcode in publicationlist:
-        vector = [str(bibcode)]
-        try:
-            properties = pub_dict[bibcode]['property']
-        except:
-            properties = []
-        if 'REFEREED' in properties:
-            vector.append(1)
-        else:
-            vector.append(0)
-        try:
-            Ncits = len(cit_dict[bibcode])
-        except:
-            Ncits = 0
-        vector.append(Ncits)
+def get_citation_records(biblist, pubs):
+    """
+    Get the citations for a chunk of bibcodes in one Solr query, as a
+    record store (see 'records.CitationRecords'). Every citing record is
+    mapped back to the bibcode(s) in the chunk that appear in its
+    reference list.
+    """
+    from adsstats.records import CitationRecords
+    cache = get_cache()
+    records = CitationRecords()
+    if cache is not None:
+        cached, biblist = cache.get_many('citations', biblist)
+        for entry in cached.values():
+            records.extend(entry)
+        if not biblist:
+            return records
+    fl = 'bibcode,property,reference'
+    list = " OR ".join(map(lambda a: "bibcode:%s"%a, biblist))
+    q = 'citations(%s)' % list
+    chunk = set(biblist)
+    Nauths = {}
+    for bibcode in biblist:
         try:
-            Ncits_ref = len(ref_cit_dict[bibcode])
+            Nauths[bibcode] = max(1,len(pubs[bibcode]['author_norm']))
         except:
-            Ncits_ref = 0
-        vector.append(Ncits_ref)
+            Nauths[bibcode] = 1
+    found = CitationRecords()
+    for doc in (doc for page in req_pages(config.SOLR_URL, q=q, fl=fl) for doc in page):
+        count('citing_docs')
+        references = doc.get('reference',[])
+        Nrefs = len(references)
+        refereed = 'REFEREED' in doc.get('property',[])
+        for bibcode in set(references).intersection(chunk):
+            found.add(doc['bibcode'], bibcode, Nrefs, Nauths[bibcode], refereed)
+    if cache is not None:
+        for bibcode in chunk:
+            cache.put('citations', bibcode, found.select([bibcode]))
+    records.extend(found)
+    return records
+
+def get_bibcodes_from_private_library(id):
+    logger.error('Private libraries are not yet implemented')
+    return []
+# C. Creation of the attribute store for stats calculations
+def make_vectors(data):
+    """
+    Create the columnar attribute store (see 'attributes.AttributeStore')
+    for the publications gathered in 'data'
+    """
+    from adsstats.attributes import AttributeStore, csr_offsets
+    refereed = []
+    authors = []
+    reads = []
+    downloads = []
+    reads_lengths = []
+    reads_values = []
+    for bibcode in data.publicationlist:
+        pub = data.pub_dict.get(bibcode, {})
+        refereed.append('REFEREED' in pub.get('property',[]))
         try:
-            Nauthors = max(1,len(pub_dict[bibcode]['author_norm']))
+            Nauthors = max(1,len(pub['author_norm']))
         except:
             Nauthors = 1
-        vector.append(Nauthors)
-        try:
-            vector.append(sum(ads_data[bibcode]['reads']))
-        except:
-            vector.append(0)
+        authors.append(Nauthors)
         try:
-            vector.append(sum(ads_data[bibcode]['downloads']))
+            yearly_reads = list(data.ads_data[bibcode]['reads'])
+            reads.append(sum(yearly_reads))
         except:
-            vector.append(0)
+            yearly_reads = []
+            reads.append(0)
+        reads_lengths.append(len(yearly_reads))
+        reads_values += yearly_reads
         try:
-            vector.append(ads_data[bibcode]['reads'])
+            downloads.append(sum(data.ads_data[bibcode]['downloads']))
         except:
-            vector.append([])
-        try:
-            vector.append(cit_dict[bibcode])
-        except:
-            vector.append([])
-        try:
-            vector.append(ref_cit_dict[bibcode])
-        except:
-            vector.append([])
-        try:
-            vector.append(non_ref_cit_dict[bibcode])
-        except:
-            vector.append([])
-        attr_list.append(vector)
-
-    return attr_list
+            downloads.append(0)
+    # the citations of every paper, in the order of the papers
+    records = data.citations
+    cit_offsets, positions = records.group(data.publicationlist)
+    return AttributeStore(data.publicationlist, refereed, authors, reads, downloads,
+                          csr_offsets(reads_lengths), reads_values, cit_offsets,
+                          records.column('year')[positions],
+                          records.column('refs')[positions],
+                          records.mask()[positions])
 
 # D. General data accumulation
-def get_attributes(args):
+def get_publication_info(args):
+    """
+    Gather the publication, citation and MongoDB data for the publications
+    specified in 'args' (a Solr 'query', a list of 'bibcodes' or a 'libid')
+    """
     solr_url = config.SOLR_URL
-    max_hits = config.MAX_HITS
-    threads  = config.THREADS
-    chunk_size = config.CHUNK_SIZE
-    if 'query' in args:
-        fl = 'bibcode,reference,author_norm,property,read_count'
-        try:
-            rsp = req(solr_url, q=args['query'], fl=fl, rows=max_hits)
-            pubdata = rsp['response']['docs']
-        except:
-            sys.stderr.write('Solr pubdata query failed\n')
-            pass
-        bibcodes = map(lambda a: a['bibcode'], pubdata)
-    elif 'bibcodes' in args:
-        pubdata = []
-        citdata = []
+    chunk_size = config.METRICS_CHUNK_SIZE
+    # All data retrieval is I/O bound: the stages run on the threads of the
+    # shared executor and the citation and MongoDB fetches for a chunk start
+    # as soon as the publication data for that chunk has been merged
+    engine = IOEngine()
+    data = PublicationData()
+    merge = partial(merge_publications, data, engine)
+    logger.info("Getting publication, citation and MongoDB data (%s threads)", engine.threads)
+    with stage('fetch'):
+        if 'query' in args:
+            fl = 'bibcode,reference,author_norm,property,read_count'
+            # the results are paged through, and every page is passed on
+            # to the citation and MongoDB fetches as soon as it arrives
+            try:
+                for pubdata in req_pages(solr_url, q=args['query'], fl=fl):
+                    for chunk in utils.chunks(pubdata,chunk_size):
+                        merge(chunk)
+            except:
+                logger.exception('Solr pubdata query failed')
+                pass
+        else:
+            if 'bibcodes' in args:
+                bibcodes = map(lambda a: a.strip(), args['bibcodes'])
+            elif 'libid' in args:
+                bibcodes = get_bibcodes_from_private_library(args['libid'])
+            logger.info("Found %s bibcodes. Splitting in batches of: %s", len(bibcodes), chunk_size)
+            for biblist in utils.chunks(bibcodes,chunk_size):
+                engine.submit(get_publication_data, biblist, callback=merge)
+        engine.wait()
+    return data
+
+def get_link_attributes(args):
+    """
+    Create the attribute store from the citation graph in the ADS link
+    files (see 'links.LinkGraph'), without any Solr or MongoDB calls
+    """
+    from adsstats.links import get_link_graph
+    if 'bibcodes' in args:
         bibcodes = map(lambda a: a.strip(), args['bibcodes'])
-        print "Found %s bibcodes. Splitting in batches of: %s" % (len(bibcodes),chunk_size)
-        biblists = list(utils.chunks(bibcodes,chunk_size))
-        print "Getting publication data"
-        stime = time.time()
-        result=Pool(threads).map(get_publication_data,biblists)
-        etime = time.time()
-        duration = etime-stime
-        print "duration: %s sec" % duration
-        for adata in publication_data:
-            pubdata += adata
     elif 'libid' in args:
         bibcodes = get_bibcodes_from_private_library(args['libid'])
+    else:
+        logger.error('Queries are not supported by the link file backend')
+        bibcodes = []
+    logger.info("Getting data from the link files")
+    with stage('fetch_links'):
+        return get_link_graph().attributes(bibcodes)
+
+def get_attribute_store(args):
+    """
+    Create the (unsorted) attribute store for the publications in 'args',
+    using the backend set in METRICS_BACKEND
+    """
+    if config.METRICS_BACKEND == 'links':
+        return get_link_attributes(args)
+    data = get_publication_info(args)
+    logger.info("Creating attribute store")
+    with stage('make_vectors'):
+        return make_vectors(data)
 
-    print "Merging publication data"
-    stime = time.time()
-    result = Pool(threads).map(merge_publications,pubdata)
-    duration = time.time() - stime
-    print "  duration: %s sec" % duration
-    print "Getting citations (alternative) for %s bibcodes" % len(bibcodes)
-    print "  # threads: %s" % threads
-    stime = time.time()
-    result=Pool(threads).map(get_citation_dictionary,bibcodes)
-    duration = time.time() - stime
-    print "  duration: %s sec" % duration
-    Nciting = len(utils.flatten(cit_dict.values()))/2
-    Nciting_ref = len(utils.flatten(ref_cit_dict.values()))/2
-    print "  total: %s citations (%s refereed citations)" % (Nciting, Nciting_ref)
-    print "Getting data from MongoDB"
-    stime = time.time()
-    result = Pool(threads).map(get_mongo_data,publicationlist)
-    duration = time.time() - stime
-    print "  duration: %s sec" % duration
-    # Generate the list of document attribute vectors and then
-    # sort this list by citations (descending).
-    # The attribute vectors will be used to calculate the metrics
-    print "Creating attribute vectors"
-    stime = time.time()
-    attr_list = make_vectors()
-    duration = time.time() - stime
-    print "  duration: %s sec" % duration
-    print "Sorting attribute vectors"
-    stime = time.time()
-    attr_list = utils.sort_list_of_lists(attr_list,2)
-    duration = time.time() - stime
-    print "  duration: %s sec" % duration
-    print "Ready for creating metrics"
+def count_citing(attr_list):
+    """
+    Returns the number of citing papers and refereed citing papers.
+    These were counted as the flattened citation records (4 fields each)
+    divided by 2; the same numbers are calculated from the store.
+    """
+    Nciting = 4*int(attr_list.citations.sum())/2
+    Nciting_ref = 4*int(attr_list.refereed_citations.sum())/2
+    return Nciting, Nciting_ref
+
+def get_attributes(args):
+    # Generate the store with the document attributes and then
+    # sort it by citations (descending).
+    # The attribute store will be used to calculate the metrics
+    attr_list = get_attribute_store(args)
+    Nciting, Nciting_ref = count_citing(attr_list)
+    logger.info("Total: %s citations (%s refereed citations)", Nciting, Nciting_ref)
+    count('papers', len(attr_list))
+    count('citations', int(attr_list.citations.sum()))
+    with stage('sort'):
+        attr_list = attr_list.sort_by_citations()
     return attr_list,Nciting,Nciting_ref
 
-# E. Function to call individual model data generation functions
-#    in parallel
-def generate_data(model_class):
-    model_class.generate_data()
-    glob_data.append(model_class.results)
+# E. The models are run by 'models.run_models', which computes the
+#    intermediate results they share only once per request
 
 # F. Format and export the end results
 # Default: 'JSON' structure of metrics 'documents'
 
-def format_results_old(**args):
+def format_results_old(data_dict, **args):
 # for now 'json' is the only output format offered
     try:
         format = args['format']
@@ -241,7 +338,7 @@ def format_results_old(**args):
         format = 'json'
 
     doc = {}
-    for entry in glob_data:
+    for entry in data_dict:
         data_dict = dict(entry)
         del data_dict['type']
         doc[entry['type']] = data_dict
@@ -284,26 +381,110 @@ def legacy_format(data):
     return data['all stats'],data['refereed stats'],data['all reads'],data['refereed reads'],data['paper histogram'],data['reads histogram'],citation_histogram,data['metrics series']
 
 # General metrics engine
+# With 'timing=True' in the arguments, the report with the timings and
+# counters of the request (see 'instrument.request') is returned as well;
+# 'profile=True' adds a cProfile summary to it
 def generate(**args):
+    from adsstats.cache import get_result_cache
+    with request('generate', profile=args.get('profile')) as recorder:
+        cache = get_result_cache()
+        if cache is None:
+            results = compute_results(args)
+        else:
+            results = cache.get(args, compute_results)
+    if args.get('timing'):
+        return results, recorder.report()
+    return results
+
+def compute_results(args):
+    import models
     attr_list,num_cit,num_cit_ref = get_attributes(args)
-    stats_models = []
     format = args.get('fmt','')
     try:
         model_types = args['types'].split(',')
     except:
-        model_types = config.DEFAULT_MODELS
-    # Instantiate the metrics classes, defined in the 'models' module
-    for model_class in models.data_models(models=model_types):
-        model_class.attributes = attr_list
-        model_class.num_citing = num_cit
-        model_class.num_citing_ref = num_cit_ref
-        model_class.results = {}
-        stats_models.append(model_class)
+        model_types = config.METRICS_DEFAULT_MODELS
+    # The models are CPU bound and share the attribute list, so they
+    # run in-process instead of being pickled into worker processes
+    data_dict = models.run_models(models.data_models(models=model_types), attr_list,
+                                  num_citing=num_cit, num_citing_ref=num_cit_ref)
 
-    rez=Pool(config.THREADS).map(generate_data, stats_models)
-
-    results = format_results(glob_data)
+    results = format_results(data_dict)
     if format == 'legacy':
         return legacy_format(results)
     else:
         return results
+
+def generate_many(bibcode_sets, **args):
+    """
+    Generate the metrics for many sets of bibcodes at once. 'bibcode_sets'
+    is a dictionary with a list of bibcodes for every name. The data for
+    every unique bibcode in these sets is retrieved only once; the metrics
+    for each set are then calculated from the shared attribute store.
+    Returns a dictionary with the results for every name; a set for which
+    no metrics can be calculated (e.g. none of its bibcodes is known) gets
+    {'error': message} instead, and does not stop the other sets.
+    """
+    with request('generate_many', profile=args.get('profile')) as recorder:
+        results = compute_many(bibcode_sets, args)
+    if args.get('timing'):
+        return results, recorder.report()
+    return results
+
+def compute_many(bibcode_sets, args):
+    format = args.get('fmt','')
+    try:
+        model_types = args['types'].split(',')
+    except:
+        model_types = config.METRICS_DEFAULT_MODELS
+    bibcodes = []
+    seen = set()
+    for biblist in bibcode_sets.values():
+        for bibcode in map(lambda a: a.strip(), biblist):
+            if bibcode not in seen:
+                seen.add(bibcode)
+                bibcodes.append(bibcode)
+    logger.info("Found %s unique bibcodes in %s sets", len(bibcodes), len(bibcode_sets))
+    store = get_attribute_store({'bibcodes':bibcodes})
+    position = dict((bibcode,i) for (i,bibcode) in enumerate(store.bibcodes))
+    names = []
+    jobs = []
+    for (name, biblist) in bibcode_sets.items():
+        # every set is taken from the shared store: papers that were
+        # not found are skipped, just like in a single request
+        index = []
+        seen = set()
+        for bibcode in map(lambda a: a.strip(), biblist):
+            if bibcode in position and bibcode not in seen:
+                seen.add(bibcode)
+                index.append(position[bibcode])
+        names.append(name)
+        jobs.append((store.take(index), model_types, format))
+    # the sets are independent: with METRICS_PROCESSES they are spread
+    # over the worker processes of the executor
+    if len(jobs) > 1:
+        results = get_executor().process_map(set_results, jobs)
+    else:
+        results = map(set_results, jobs)
+    return dict(zip(names, results))
+
+def set_results(job):
+    """
+    The results for one set of bibcodes in 'compute_many', or
+    {'error': message} when they cannot be calculated
+    """
+    import models
+    attr_list, model_types, format = job
+    if not len(attr_list):
+        return {'error': 'None of the bibcodes were found'}
+    try:
+        attr_list = attr_list.sort_by_citations()
+        num_cit, num_cit_ref = count_citing(attr_list)
+        data_dict = models.run_models(models.data_models(models=model_types), attr_list,
+                                      num_citing=num_cit, num_citing_ref=num_cit_ref)
+        if format == 'legacy':
+            return legacy_format(format_results(data_dict))
+        return format_results(data_dict)
+    except Exception as e:
+        logger.exception('Metrics for a set of %s papers failed', len(attr_list))
+        return {'error': str(e)}
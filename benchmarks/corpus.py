@@ -0,0 +1,76 @@
+import numpy as np
+
+# last year for which citing papers and reads are generated
+LAST_YEAR = 2024
+
+def make_bibcode(year, i, journal='BENCH'):
+    return ('%4d%s%010d' % (year, journal[:5], i)).ljust(19, '.')[:19]
+
+class Corpus(object):
+    """
+    Synthetic, reproducible corpus for the benchmarks: a bibliography of
+    'papers' publications and the papers citing them.
+
+        papers              number of publications in the bibliography
+        citation_exponent   exponent of the power law of the number of
+                            citations per paper (larger: fewer citations)
+        max_citations       cut-off of the citation distribution
+        references          mean number of references of a citing paper
+        reads_per_year      mean number of reads per paper per year
+        refereed_fraction   fraction of refereed papers
+        seed                seed of the random generator
+
+    'solr_docs' holds the Solr documents (bibliography and citing papers)
+    and 'mongo_docs' the MongoDB documents (reads, downloads) per bibcode.
+    """
+    def __init__(self, papers=100, citation_exponent=2.0, max_citations=5000,
+                 references=30, reads_per_year=20.0, refereed_fraction=0.8, seed=42):
+        rnd = np.random.RandomState(seed)
+        self.papers = papers
+        years = rnd.randint(1980, LAST_YEAR+1, size=papers)
+        self.bibcodes = [make_bibcode(y, i) for (i, y) in enumerate(years)]
+        # citations per paper: discrete power law, capped
+        citations = np.minimum(rnd.zipf(citation_exponent, size=papers) - 1, max_citations)
+        # every citation gets a citing paper; citing papers cite on average
+        # a few papers of the bibliography, and further (external) papers
+        Ncitations = int(citations.sum())
+        Nciting = max(1, Ncitations // 3)
+        cited = np.repeat(np.arange(papers), citations)
+        citing = rnd.randint(0, Nciting, size=Ncitations)
+        citing_year = np.minimum(LAST_YEAR, years[cited] + rnd.geometric(0.3, size=Ncitations) - 1)
+        citing_refs = dict()
+        citing_years = dict()
+        for (c, p, y) in zip(citing, cited, citing_year):
+            citing_refs.setdefault(c, set()).add(self.bibcodes[p])
+            citing_years[c] = min(citing_years.get(c, y), y)
+        self.solr_docs = {}
+        for (i, bibcode) in enumerate(self.bibcodes):
+            self.solr_docs[bibcode] = {
+                'bibcode': bibcode,
+                'author_norm': ['Author, %d' % k for k in range(rnd.randint(1, 12))],
+                'property': self._property(rnd, refereed_fraction),
+                'reference': [],
+                'read_count': 0}
+        for (c, refs) in citing_refs.items():
+            bibcode = make_bibcode(citing_years[c], c, journal='CITES')
+            external = ['1990EXTRN%010d' % k for k in rnd.randint(0, 10**6, size=rnd.poisson(references))]
+            self.solr_docs[bibcode] = {
+                'bibcode': bibcode,
+                'author_norm': ['Author, 0'],
+                'property': self._property(rnd, refereed_fraction),
+                'reference': sorted(refs) + external}
+        self.mongo_docs = {}
+        for (bibcode, year) in zip(self.bibcodes, years):
+            Nyears = LAST_YEAR - 1996 + 1
+            reads = rnd.poisson(reads_per_year, size=Nyears)
+            # no reads before the paper was published
+            reads[:max(0, year - 1996)] = 0
+            self.mongo_docs[bibcode] = {'_id': bibcode,
+                                        'reads': map(int, reads),
+                                        'downloads': map(int, reads // 2),
+                                        'full': 'x' * 1000}
+
+    def _property(self, rnd, refereed_fraction):
+        if rnd.random_sample() < refereed_fraction:
+            return ['REFEREED', 'ARTICLE']
+        return ['NOT REFEREED', 'ARTICLE']
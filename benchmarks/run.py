@@ -0,0 +1,142 @@
+"""
+Benchmarks for the stages of the metrics pipeline and for every model
+class, on synthetic corpora of increasing size, run against in-process
+stand-ins for Solr and adsdata. Results are written as JSON; a previous
+result file can be given to flag regressions.
+
+    python -m benchmarks.run --sizes 10,100,1000 --output results.json
+    python -m benchmarks.run --compare results.json
+"""
+import os
+import sys
+import time
+import platform
+import argparse
+import subprocess
+import simplejson as json
+import numpy as np
+# metrics specific modules
+from config import config
+from adsstats import stats_utils
+from adsstats.client import get_client
+import models
+from benchmarks.corpus import Corpus
+from benchmarks.standins import SolrStandin, AdsdataStandin
+
+DEFAULT_SIZES = '10,100,1000,10000,100000'
+
+def timed(func, repeat):
+    """
+    Runs 'func' 'repeat' times; returns the timings and the last result
+    """
+    timings = []
+    for i in range(repeat):
+        stime = time.time()
+        result = func()
+        timings.append(time.time() - stime)
+    return timings, result
+
+def benchmark_size(size, repeat, seed):
+    corpus = Corpus(papers=size, seed=seed)
+    solr = SolrStandin(corpus.solr_docs)
+    config.SOLR_URL = solr.url
+    stats_utils._session = AdsdataStandin(corpus.mongo_docs)
+    args = {'bibcodes': corpus.bibcodes}
+    results = []
+    def record(stage, timings, **extra):
+        entry = {'size': size, 'stage': stage, 'repeat': len(timings),
+                 'min': min(timings), 'median': float(np.median(timings))}
+        entry.update(extra)
+        results.append(entry)
+        print "  %-36s %10.4f sec" % (stage, entry['min'])
+    try:
+        requests = solr.requests
+        timings, data = timed(lambda: stats_utils.get_publication_info(args), repeat)
+        record('fetch', timings, solr_requests=(solr.requests - requests)/len(timings))
+        timings, store = timed(lambda: stats_utils.make_vectors(data), repeat)
+        record('make_vectors', timings, citations=int(store.citations.sum()))
+        timings, store = timed(store.sort_by_citations, repeat)
+        record('sort_by_citations', timings)
+        num_cit, num_cit_ref = stats_utils.count_citing(store)
+        model_classes = models.data_models(models=config.METRICS_DEFAULT_MODELS)
+        for model_class in model_classes:
+            # every model on its own, including the intermediates it requires
+            timings, _ = timed(lambda: models.run_models([model_class], store, num_cit, num_cit_ref), repeat)
+            record('model:%s' % model_class.__name__, timings)
+        timings, _ = timed(lambda: models.run_models(model_classes, store, num_cit, num_cit_ref), repeat)
+        record('models', timings)
+        timings, (_, report) = timed(lambda: stats_utils.generate(timing=True, **args), repeat)
+        record('generate', timings, counters=report['counters'])
+    finally:
+        # drop the kept-alive connections before the stand-in goes away
+        get_client().close()
+        solr.close()
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=open(os.devnull, 'w')).strip()
+    except:
+        return None
+
+def compare(results, baseline, threshold, min_time):
+    """
+    Prints the ratio of the timings to those in 'baseline' and returns
+    the number of stages that became slower than 'threshold' times, and
+    by more than 'min_time' seconds
+    """
+    previous = dict(((r['size'], r['stage']), r) for r in baseline['results'])
+    regressions = 0
+    for entry in results:
+        old = previous.get((entry['size'], entry['stage']))
+        if old is None or not old['min']:
+            continue
+        ratio = entry['min'] / old['min']
+        flag = ''
+        if ratio > threshold and entry['min'] - old['min'] > min_time:
+            flag = 'REGRESSION'
+            regressions += 1
+        print "%8s %-36s %8.2fx %s" % (entry['size'], entry['stage'], ratio, flag)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the metrics pipeline')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='comma separated numbers of papers')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage (the minimum is reported)')
+    parser.add_argument('--seed', type=int, default=42, help='seed for the synthetic corpus')
+    parser.add_argument('--output', help='file for the JSON results')
+    parser.add_argument('--compare', help='JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown ratio reported as a regression')
+    parser.add_argument('--min-time', type=float, default=0.001,
+                        help='smallest slowdown (seconds) reported as a regression')
+    args = parser.parse_args(argv)
+    # every run has to do the actual work
+    config.METRICS_CACHE_ENABLED = False
+    config.METRICS_RESULT_CACHE_ENABLED = False
+    config.METRICS_BACKEND = 'solr'
+    results = []
+    for size in map(int, args.sizes.split(',')):
+        print "%s papers" % size
+        results += benchmark_size(size, args.repeat, args.seed)
+    output = {'commit': git_commit(),
+              'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'threads': config.METRICS_THREADS,
+              'chunk_size': config.METRICS_CHUNK_SIZE,
+              'seed': args.seed,
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold, args.min_time):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
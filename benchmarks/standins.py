@@ -0,0 +1,101 @@
+import re
+import copy
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+import simplejson as json
+
+_bibcode = re.compile(r'bibcode:([^\s)]+)')
+
+class SolrStandin(object):
+    """
+    In-process stand-in for the Solr 'select' endpoint, serving the
+    documents of a corpus over HTTP. It understands the queries the
+    metrics module sends: 'bibcode:X OR bibcode:Y ...', optionally
+    wrapped in 'citations(...)', with 'fl', 'rows', 'start' and
+    'cursorMark' (results are in bibcode order).
+    """
+    def __init__(self, docs):
+        self.docs = docs
+        self.cited_by = {}
+        for (bibcode, doc) in docs.items():
+            for reference in set(doc.get('reference', [])):
+                self.cited_by.setdefault(reference, []).append(bibcode)
+        self.requests = 0
+        standin = self
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def do_GET(self):
+                params = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+                body = json.dumps(standin.select(params))
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d/solr/select' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def select(self, params):
+        self.requests += 1
+        q = params.get('q', [''])[0]
+        bibcodes = _bibcode.findall(q)
+        if q.startswith('citations('):
+            found = set()
+            for bibcode in bibcodes:
+                found.update(self.cited_by.get(bibcode, []))
+        else:
+            found = set(b for b in bibcodes if b in self.docs)
+        found = sorted(found)
+        rows = int(params.get('rows', ['10'])[0])
+        start = int(params.get('start', ['0'])[0])
+        cursor = params.get('cursorMark', [None])[0]
+        if cursor is not None:
+            start = 0 if cursor == '*' else int(cursor)
+        fields = params.get('fl', [''])[0].split(',')
+        docs = [dict((f, self.docs[b][f]) for f in fields if f in self.docs[b])
+                for b in found[start:start+rows]]
+        rsp = {'response': {'numFound': len(found), 'start': start, 'docs': docs}}
+        if cursor is not None:
+            rsp['nextCursorMark'] = str(start + len(docs)) if docs else cursor
+        return rsp
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class Collection(object):
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, spec, fields=None):
+        for bibcode in spec['_id']['$in']:
+            doc = self.docs.get(bibcode)
+            if doc is None:
+                continue
+            if fields is None:
+                yield copy.deepcopy(doc)
+            else:
+                yield dict([('_id', bibcode)] + [(f, list(doc[f])) for f in fields if f in doc])
+
+class AdsdataStandin(object):
+    """
+    In-process stand-in for an 'adsdata' session, serving the MongoDB
+    documents of a corpus
+    """
+    def __init__(self, docs):
+        self.docs = docs
+
+    def get_doc(self, bibcode):
+        return copy.deepcopy(self.docs.get(bibcode))
+
+    def get_collection(self, name):
+        return Collection(self.docs)
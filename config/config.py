@@ -6,10 +6,66 @@ class AppConfig(object):
 
 #    LOG_DIR = os.path.exists(_basedir + "/logs") and _basedir + "/logs" or "."
     METRICS_DEFAULT_MODELS = ['statistics','histograms','metrics','series']
+    # the worker pools are created once per process and shared by all
+    # requests (see adsstats/engine.py): threads for the I/O bound fetches
+    # and, when not 0, worker processes for the models of 'generate_many'
     METRICS_THREADS = 8
+    METRICS_PROCESSES = 0
+    # threads for background work, such as refreshing stale cached results
+    METRICS_BACKGROUND_THREADS = 2
+    # seconds a no-op task may take through the pools in a health check
+    METRICS_HEALTH_TIMEOUT = 5
     METRICS_MIN_BIBLIO_LENGTH = 5
     METRICS_CHUNK_SIZE = 100
     METRICS_MAX_HITS = 100000
+    # rows per page for the cursor paged queries, sorted on the unique key
+    METRICS_PAGE_SIZE = 1000
+    METRICS_CURSOR_SORT = 'id asc'
+    METRICS_HTTP_POOL_SIZE = 16
+    METRICS_HTTP_POOL_BLOCK = False
+    # (connect, read) timeouts in seconds
+    METRICS_HTTP_TIMEOUT = (5, 120)
+    METRICS_ADSDATA_PATH = '/proj/adsx/adsdata'
+    # source of the publication data: 'solr' (Solr and MongoDB) or 'links'
+    # (the link files in MONGO_DATA_COLLECTIONS, see adsstats/links.py)
+    METRICS_BACKEND = 'solr'
+    # overrides of the link file paths, and the optional 'authors' file
+    METRICS_LINK_FILES = {}
+    # binary snapshot of the link files (see adsstats/snapshot.py), used
+    # by the 'links' backend instead of the link files when set
+    METRICS_SNAPSHOT_PATH = None
+    # per-bibcode data cache, shared by all requests in a process
+    METRICS_CACHE_ENABLED = True
+    METRICS_CACHE_MAX_BYTES = 256*1024*1024
+    # directory for the on-disk tier (None: memory only)
+    METRICS_CACHE_DIR = None
+    # size limit of the on-disk tier; expired files are removed first
+    METRICS_CACHE_DISK_MAX_BYTES = 1024*1024*1024
+    # time to live (seconds) per data type; types not listed are not cached
+    METRICS_CACHE_TTL = {'publication': 3600, 'citations': 3600, 'mongo': 86400}
+    # optional cache for the results of 'generate'; with METRICS_RESULT_STALE_TTL
+    # set, results older than METRICS_RESULT_TTL are served for that many more
+    # seconds while they are refreshed in the background
+    METRICS_RESULT_CACHE_ENABLED = False
+    METRICS_RESULT_CACHE_MAX_BYTES = 64*1024*1024
+    METRICS_RESULT_TTL = 3600
+    METRICS_RESULT_STALE_TTL = 0
+    # token for the version of the indexed data; cached results are only
+    # used for the epoch they were calculated in (see cache.set_data_epoch)
+    METRICS_DATA_EPOCH = ''
+    # run every request under cProfile, and the number of lines of the
+    # profile in the report (see adsstats/instrument.py)
+    METRICS_PROFILE = False
+    METRICS_PROFILE_LINES = 40
+    # service mode (see adsstats/service.py): requests arriving within
+    # METRICS_BATCH_WINDOW seconds (at most METRICS_BATCH_MAX) share one fetch
+    METRICS_SERVICE_HOST = '127.0.0.1'
+    METRICS_SERVICE_PORT = 8080
+    METRICS_SERVICE_WORKERS = 4
+    METRICS_BATCH_WINDOW = 0.01
+    METRICS_BATCH_MAX = 100
+    # number of recent requests in the latency statistics
+    METRICS_SERVICE_LATENCY_WINDOW = 1000
     MONGO_DATABASE = 'adsdata'
     MONGO_HOST = "localhost"
     MONGO_PORT = 27017
@@ -36,6 +92,9 @@ class AppConfig(object):
         }
     
     MONGO_DATA_LOAD_BATCH_SIZE = 100000
+    # bibcodes per query, and the fields retrieved, for the reads and downloads
+    METRICS_MONGO_BATCH_SIZE = 1000
+    METRICS_MONGO_FIELDS = ['reads', 'downloads']
 
     SOLR_URL = 'http://adswhy:9000/solr/collection1/select'
 try:
@@ -2,14 +2,54 @@ from models import *
 
 import sys
 import inspect
+from adsstats.instrument import stage
 
 model_map = {'statistics':Statistics,'histograms':Histogram,'metrics':Metrics,'series':TimeSeries}
+# registry of model classes per model type, built on first use
+_registry = None
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        registry = {}
+        for name, obj in inspect.getmembers(sys.modules[__name__]):
+            for model_type, base in model_map.items():
+                if inspect.isclass(obj) and base in obj.__bases__:
+                    registry.setdefault(model_type, []).append(obj)
+        _registry = registry
+    return _registry
 
 def data_models(models = []):
-    models = filter(lambda a: a in model_map.keys(), models)
+    registry = get_registry()
     dc = []
-    for name, obj in inspect.getmembers(sys.modules[__name__]):
-        for model_type in models:
-         if inspect.isclass(obj) and model_map[model_type] in obj.__bases__:
-            dc.append(obj)
+    for model_type in filter(lambda a: a in model_map.keys(), models):
+        dc += registry.get(model_type, [])
     return dc
+
+def run_models(model_classes, store, num_citing=0, num_citing_ref=0, data=None):
+    """
+    Calculates all models in 'model_classes' for the attribute store 'store'.
+    The intermediate results the models require are calculated first, each
+    of them once, after which every model is calculated from these shared
+    data in the same process. An existing ModelData for the store can be
+    passed in 'data', to reuse the intermediate results it holds.
+    Every model class is instantiated for this calculation only.
+    Returns a list with the results of every model
+    """
+    if data is None:
+        data = ModelData(store)
+    for model_class in model_classes:
+        for name in model_class.requires:
+            data.get(name)
+    results = []
+    for model_class in model_classes:
+        model = model_class()
+        model.attributes = store
+        model.data = data
+        model.num_citing = num_citing
+        model.num_citing_ref = num_citing_ref
+        model.results = {}
+        with stage('model:%s' % model_class.__name__):
+            model.generate_data()
+        results.append(model.results)
+    return results
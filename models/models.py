@@ -4,14 +4,16 @@ import site
 import operator
 site.addsitedir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # get modules for math operations
-from numpy import mean
 from numpy import median
 from numpy import vdot as vector_product
 from numpy import sqrt
 from numpy import histogram
+import numpy as np
 import math
 # get access to local helper functions
 from config import config
+from adsstats.attributes import READS_START_YEAR
+from adsstats.instrument import stage
 # JSON functionality
 import simplejson as json
 
@@ -32,21 +34,197 @@ def get_timespan(biblist):
     span  = maxYr - minYr + 1
     return max(span,1)
 
-def get_subset(mlist,year):
+def citation_indices(citations):
     """
-    Gets the entries out of the list of "attribute" vectors for a certain year
+    Returns the Hirsch, g and i10 indices for an array of citation
+    counts, sorted in descending order
     """
-    newlist = []
-    for entry in mlist:
-        if int(entry[0][:4]) > int(year):
-            continue
-        newvec = entry[:9]
-        citations = entry[8]
-        citations = filter(lambda a: int(a[0][:4]) <= int(year), citations)
-        newvec.append(citations)
-        newvec[2]  = len(citations)
-        newlist.append(newvec)
-    return newlist
+    rank = np.arange(1, len(citations)+1)
+    h = int((citations >= rank).sum())
+    g_ranks = rank[rank*rank <= np.cumsum(citations, dtype=np.int64)]
+    g = int(g_ranks[-1]) if len(g_ranks) else 0
+    i10 = int((citations >= 10).sum())
+    return h, g, i10
+
+def histogram_indices(hist):
+    """
+    Returns the Hirsch, g and i10 indices from a histogram of citation
+    counts, where hist[c] is the number of papers with c citations
+    """
+    counts = np.arange(len(hist))
+    # number of papers with at least c citations
+    at_least = np.cumsum(hist[::-1])[::-1]
+    h_ranks = counts[(at_least >= counts) & (counts >= 1)]
+    h = int(h_ranks[-1]) if len(h_ranks) else 0
+    i10 = int(at_least[10]) if len(hist) > 10 else 0
+    # For the g index, the papers sorted by citations (descending) form
+    # blocks of papers with equal citations: the sum S(r) of the top r
+    # citations is linear within a block. Since 'S(r) >= r*r' holds up to
+    # g and fails after that, g lies in the last block for which it holds
+    # at the first rank of the block.
+    values = counts[::-1][hist[::-1] > 0]
+    Npapers = hist[values]
+    end_rank = np.cumsum(Npapers)
+    end_sum = np.cumsum(Npapers*values)
+    start_rank = end_rank - Npapers
+    start_sum = end_sum - Npapers*values
+    blocks = np.nonzero(start_sum + values >= (start_rank + 1)**2)[0]
+    if not len(blocks):
+        return h, 0, i10
+    b = blocks[-1]
+    v, r0, S0, r1 = int(values[b]), int(start_rank[b]), int(start_sum[b]), int(end_rank[b])
+    # largest r with S0 + (r - r0)*v >= r*r
+    r = int((v + math.sqrt(v*v + 4*(S0 - r0*v)))/2)
+    while S0 + (r - r0)*v < r*r:
+        r -= 1
+    while S0 + (r + 1 - r0)*v >= (r + 1)*(r + 1):
+        r += 1
+    return h, min(r, r1), i10
+
+def tori_weights(references, authors):
+    """
+    Returns the contribution to the tori index of citations from papers
+    with 'references' references, to papers with 'authors' authors
+    """
+    return 1.0/(np.maximum(references,config.METRICS_MIN_BIBLIO_LENGTH)*authors).astype(float)
+
+def tori_sum(weights):
+    """
+    Adds up tori contributions in order, just like the built-in 'sum'
+    (which also means that the tori index is 0 without citations)
+    """
+    if not len(weights):
+        return 0
+    return float(np.cumsum(weights)[-1])
+
+def statistics_table(data):
+    """
+    Calculates the statistics for all Statistics models at once: the rows
+    of a (models x papers) matrix hold the values for every model, and the
+    statistics are calculated along the rows for all papers and, with a
+    mask, for the refereed papers.
+    Returns a dictionary with the statistics for every model
+    """
+    store = data.store
+    columns = Statistics.columns
+    values = np.empty((len(columns), len(store)), dtype=np.int64)
+    for row, column in enumerate(columns):
+        if column == 'publications':
+            values[row] = 1
+        else:
+            values[row] = getattr(store, column)
+    weights = data.get('weights')
+    table = dict((column, {}) for column in columns)
+    for prefix, mask in (('', slice(None)), ('refereed_', store.refereed)):
+        data = values[:,mask]
+        data_weights = weights[mask]
+        number = data.shape[1]
+        means = data.mean(axis=1)
+        medians = median(data, axis=1)
+        totals = data.sum(axis=1)
+        for row, column in enumerate(columns):
+            stats = table[column]
+            stats[prefix + 'number'] = number
+            if number:
+                stats[prefix + 'normalized'] = vector_product(data[row], data_weights)
+            else:
+                # without entries, keep what vector_product gives for empty lists
+                stats[prefix + 'normalized'] = vector_product([], [])
+            stats[prefix + 'mean'] = means[row]
+            stats[prefix + 'median'] = medians[row]
+            stats[prefix + 'total'] = int(totals[row])
+    return table
+
+def citation_histograms(data):
+    """
+    Calculates the histograms for all citation histogram models at once.
+    Every citation gets an index into the citing year bins and the weight
+    of the cited paper; the histograms then follow from 'bincount' on
+    these shared arrays, using the refereed flags of the citing and cited
+    papers to select entries.
+    Returns a dictionary with the (regular, refereed, normalized, refereed
+    normalized) histograms for every model
+    """
+    store = data.store
+    today = datetime.today()
+    if len(store):
+        min_year = int(store.year.min())
+    else:
+        min_year = 9999
+    bins = np.arange(min_year, today.year+2)
+    Nbins = max(len(bins) - 1, 0)
+    paper = data.get('cit_paper')
+    index = store.cit_year - np.int16(min_year)
+    # like numpy.histogram, the last bin includes its upper edge
+    index[index == Nbins] = Nbins - 1
+    keep = (index >= 0) & (index < Nbins)
+    index = index[keep]
+    weights = data.get('weights')[paper[keep]]
+    refereed_paper = store.refereed[paper[keep]]
+    refereed_citation = store.cit_refereed[keep]
+    # counts per bin for the four (refereed citation, refereed paper) groups
+    group = 2*refereed_citation + refereed_paper
+    counts = np.bincount(4*index.astype(np.int64) + group, minlength=4*Nbins).reshape(Nbins, 4)
+    selections = {
+        'all_citation_histogram': (slice(None), counts.sum(axis=1), counts[:,1] + counts[:,3]),
+        'refereed_citation_histogram': (refereed_citation, counts[:,2] + counts[:,3], counts[:,3]),
+        'non_refereed_citation_histogram': (~refereed_citation, counts[:,0] + counts[:,1], counts[:,1]),
+    }
+    histograms = {}
+    for name, (citations, values, refereed_values) in selections.items():
+        refereed = refereed_paper[citations]
+        normalized = np.bincount(index[citations], weights=weights[citations],
+                                 minlength=Nbins).astype(float)
+        refereed_normalized = np.bincount(index[citations][refereed], weights=weights[citations][refereed],
+                                          minlength=Nbins).astype(float)
+        histograms[name] = ((values, bins), (refereed_values, bins),
+                            (normalized, bins), (refereed_normalized, bins))
+    return histograms
+
+# Intermediate results shared by the models: every model lists the ones it
+# needs in 'requires', and each of them is calculated only once per request
+INTERMEDIATES = {
+    # the normalization weight (1/number of authors) of every paper
+    'weights': lambda data: data.store.weights,
+    # the index of the cited paper for every citation
+    'cit_paper': lambda data: data.store.cit_paper,
+    # the tori contribution of every citation
+    'tori_weights': lambda data: tori_weights(data.store.cit_refs,
+                                              data.store.authors[data.get('cit_paper')]),
+    # citations of all/refereed papers, descending order
+    'sorted_citations': lambda data: np.sort(data.store.citations)[::-1],
+    'sorted_refereed_citations': lambda data: np.sort(data.store.citations[data.store.refereed])[::-1],
+    'time_span': lambda data: get_timespan(data.store.bibcodes),
+    'reads_matrix': lambda data: data.store.reads_matrix(),
+    'statistics': statistics_table,
+    'citation_histograms': citation_histograms,
+}
+
+# The intermediate results that change when the citations or the
+# reads/downloads of the papers in the store change
+DEPENDENCIES = {
+    'citations': ('cit_paper', 'tori_weights', 'sorted_citations',
+                  'sorted_refereed_citations', 'statistics', 'citation_histograms'),
+    'reads': ('reads_matrix', 'statistics'),
+}
+
+class ModelData(object):
+    """
+    The attribute store of a request, together with the intermediate
+    results (see INTERMEDIATES) that the models derive from it. Every
+    intermediate result is calculated on first use and then shared.
+    """
+    def __init__(self, store):
+        self.store = store
+        self._intermediates = {}
+
+    def get(self, name):
+        try:
+            return self._intermediates[name]
+        except KeyError:
+            with stage('intermediate:%s' % name):
+                value = self._intermediates[name] = INTERMEDIATES[name](self)
+            return value
 
 #### Abstract data models:
 # Every abstract model contains machinery to calculate the appropriate statistics,
@@ -54,59 +232,59 @@ def get_subset(mlist,year):
 # How the data are provided is implemented in every specific class that inherits from
 # the general model class, by implementing a specific 'pre_process' method. Similarly, the
 # specific results are implemented by overloading the general 'post_process' method.
+# The intermediate results a model needs are listed in 'requires' and are taken
+# from 'self.data' (a ModelData instance), so that they are computed only once.
+# Models are instantiated for every request (see 'run_models'), so that all
+# state of a calculation lives on the instance and requests never share it.
 class Statistics():
     """
-    Statistics class calculates statistics for a list of numbers and 
-    associated weights.
-    Input data consists of Python list: 
-        L = [..., (number, weight), ...], 
-    so that the frequency for item k is L[k][0], and the weight for 
-    item k is l[k][1]  (k=0,...,N).
+    Statistics class calculates statistics for a column of the attribute
+    store (the 'column' of the specific class) and the associated weights
+    (1/number of authors), for all papers and for the refereed papers.
+    The statistics for all specific classes are calculated in one go by
+    'statistics_table' and shared through the request's ModelData.
     """
-    @classmethod
-    def generate_data(cls):
+    # the attribute store columns used by the specific classes
+    columns = ('publications', 'reads', 'downloads', 'citations', 'refereed_citations')
+    requires = ('statistics',)
+
+    def generate_data(self):
         """
         get statistics for a list of values and associated weights:
             mean, median, normalized values
         """
-        cls.pre_process()
-        #
-        values = map(lambda a: a[0], cls.data)
-        weights= map(lambda a: a[1], cls.data)
-        refereed_values = map(lambda a: a[0], cls.refereed_data)
-        refereed_weights= map(lambda a: a[1], cls.refereed_data)
+        self.pre_process()
+        stats = self.data.get('statistics')[self.column]
         # get number of entries
-        cls.number_of_entries = len(values)
+        self.number_of_entries = stats['number']
         # get number of refereed entries
-        cls.number_of_refereed_entries = len(refereed_values)
+        self.number_of_refereed_entries = stats['refereed_number']
         # get normalized value
-        cls.normalized_value = vector_product(values,weights)
+        self.normalized_value = stats['normalized']
         # get refereed normalized value
-        cls.refereed_normalized_value = vector_product(refereed_values,refereed_weights)
+        self.refereed_normalized_value = stats['refereed_normalized']
         # get mean value of values
-        cls.mean_value = mean(values)
+        self.mean_value = stats['mean']
         # get mean value of refereed values
-        cls.refereed_mean_value = mean(refereed_values)
+        self.refereed_mean_value = stats['refereed_mean']
         # get median value of values
-        cls.median_value = median(values)
+        self.median_value = stats['median']
         # get median value of refereed values
-        cls.refereed_median_value = median(refereed_values)
+        self.refereed_median_value = stats['refereed_median']
         # get total of values
-        cls.total_value = sum(values)
+        self.total_value = stats['total']
         # get total of refereed values
-        cls.refereed_total_value = sum(refereed_values)
+        self.refereed_total_value = stats['refereed_total']
         # record results
-        cls.post_process()
+        self.post_process()
 
-    @classmethod
-    def pre_process(cls, *args, **kwargs):
+    def pre_process(self, *args, **kwargs):
         """
         this method gets called immediately before the data load.
         subclasses should override
         """
         pass
-    @classmethod
-    def post_process(cls, *args, **kwargs):
+    def post_process(self, *args, **kwargs):
         """
         this method gets called immediately following the data load.
         subclasses should override
@@ -120,59 +298,43 @@ class Statistics():
 #    print sum(map(lambda c: 1.0/float(c), map(lambda b: max(b[1],config.METRICS_MIN_BIBLIO_LENGTH)*b[2],filter(lambda a: len(a) > 0, tori_list))))
 
 class Metrics():
+    # the intermediate results (see INTERMEDIATES) used by the model
+    requires = ()
 
-    @classmethod
-    def generate_data(cls):
-        cls.pre_process()
+    def generate_data(self):
+        self.pre_process()
         # array with citations, descending order
-        citations = cls.citations
-        citations.sort()
-        citations.reverse()
-        # first calclate the Hirsch and g indices
-        rank = 1
-        N = 0
-        h = 0
-        g = 0
-        for cite in citations:
-            N += cite
-            r2 = rank*rank
-            if r2 <= N:
-                g = rank
-            h += min(1, cite/rank)
-            rank += 1
+        citations = self.citations
+        # first calclate the Hirsch, g and i10 indices
+        h, g, i10 = citation_indices(citations)
         # the e-index
         try:
-            e = sqrt(sum(citations[:h]) - h*h)
+            e = sqrt(citations[:h].sum() - h*h)
         except:
             e = 'NA'
-        # get the Tori index
-        tori_list = [item for sublist in cls.tori_data for item in sublist]
-        tori = sum(map(lambda c: 1.0/float(c), 
-                   map(lambda b: max(b[1],config.METRICS_MIN_BIBLIO_LENGTH)*b[2],
-                   filter(lambda a: len(a) > 0, tori_list))))
+        # get the Tori index ('tori_data' holds the contribution of every citation)
+        tori = tori_sum(self.tori_data)
         try:
-            riq = int(1000.0*sqrt(float(tori))/float(cls.time_span))
+            riq = int(1000.0*sqrt(float(tori))/float(self.time_span))
         except:
             riq = "NA"
-        cls.h_index = h
-        cls.g_index = g
-        cls.m_index = float(h)/float(cls.time_span)
-        cls.i10_index = len(filter(lambda a: a >= 10, citations))
-        cls.e_index = e
-        cls.tori = tori
-        cls.riq  = riq
-
-        cls.post_process()
-
-    @classmethod
-    def pre_process(cls, *args, **kwargs):
+        self.h_index = h
+        self.g_index = g
+        self.m_index = float(h)/float(self.time_span)
+        self.i10_index = i10
+        self.e_index = e
+        self.tori = tori
+        self.riq  = riq
+
+        self.post_process()
+
+    def pre_process(self, *args, **kwargs):
         """
         this method gets called immediately before the data load.
         subclasses should override
         """
         pass
-    @classmethod
-    def post_process(cls, *args, **kwargs):
+    def post_process(self, *args, **kwargs):
         """
         this method gets called immediately following the data load.
         subclasses should override
@@ -181,53 +343,50 @@ class Metrics():
 
 # Histogram class
 class Histogram():
+    # the intermediate results (see INTERMEDIATES) used by the model
+    requires = ()
 
-    @classmethod
-    def generate_data(cls):
+    def generate_data(self):
         """
         Get histogram for a list of values and associated weights
         The weights are used for a normalized histogram
         """
-        cls.results = {}
-        cls.pre_process()
+        self.results = {}
+        self.pre_process()
         today = datetime.today()
         skip = None
-        values = map(lambda a: a[0], cls.data)
-        if len(values) == 0 and 'citation' not in cls.config_data_name:
+        values = self.values
+        if len(values) == 0 and 'citation' not in self.config_data_name:
             skip = True
-        weights= map(lambda a: a[1], cls.data)
-        if cls.config_data_name == 'reads_histogram':
-            bins = range(1996, today.year+2)
-        elif cls.min_year:
-            bins = range(cls.min_year, today.year+2)
+        weights= self.weights
+        if self.min_year:
+            bins = range(self.min_year, today.year+2)
         else:
             try:
-                bins = range(min(values),max(values)+2)
+                bins = range(int(values.min()),int(values.max())+2)
             except:
                 skip = True
         if not skip:
-            refereed_values = map(lambda a: a[0], cls.refereed_data)
-            refereed_weights= map(lambda a: a[1], cls.refereed_data)
+            refereed_values = values[self.refereed]
+            refereed_weights= weights[self.refereed]
             # get the regular histogram
-            cls.value_histogram = histogram(values,bins=bins)
-            cls.refereed_value_histogram = histogram(refereed_values,bins=bins)
+            self.value_histogram = histogram(values,bins=bins)
+            self.refereed_value_histogram = histogram(refereed_values,bins=bins)
             # get the normalized histogram
-            cls.normalized_value_histogram = histogram(values,bins=bins,weights=weights)
-            cls.refereed_normalized_value_histogram = histogram(refereed_values,bins=bins,weights=refereed_weights)
+            self.normalized_value_histogram = histogram(values,bins=bins,weights=weights)
+            self.refereed_normalized_value_histogram = histogram(refereed_values,bins=bins,weights=refereed_weights)
         else:
-            cls.value_histogram = False
-            cls.results[str(today.year)] = "0:0:0:0"
-        cls.post_process()
+            self.value_histogram = False
+            self.results[str(today.year)] = "0:0:0:0"
+        self.post_process()
 
-    @classmethod
-    def pre_process(cls, *args, **kwargs):
+    def pre_process(self, *args, **kwargs):
         """
         this method gets called immediately before the data load.
         subclasses should override
         """
         pass
-    @classmethod
-    def post_process(cls, *args, **kwargs):
+    def post_process(self, *args, **kwargs):
         """
         this method gets called immediately following the data load.
         subclasses should override
@@ -236,58 +395,81 @@ class Histogram():
 
 # Time Series class
 class TimeSeries():
+    # the intermediate results (see INTERMEDIATES) used by the model
+    requires = ()
 
-    @classmethod
-    def generate_data(cls):
+    def generate_data(self):
         """
         Get time series
+        The citations are sorted by year once, and the years are swept in
+        order: every year only the new citations and the newly published
+        papers update the citation counts, the histogram of citation counts
+        of the papers published so far (from which the indices follow).
+        The tori index of a year is the sum of the contributions counted by
+        then, added up in store order; it is only summed again in years
+        with new contributions.
         """
         today = datetime.today()
-        bibcodes = map(lambda a: a[0], cls.attributes)
-        years = map(lambda a: int(a[:4]), bibcodes)
-        minYear = min(years)
+        store = self.attributes
+        minYear = int(store.year.min())
         maxYear = today.year
-        cls.series = {}
-        cls.pre_process()
-        tori_list = [item for sublist in cls.tori_data for item in sublist]
+        self.series = {}
+        self.pre_process()
+        paper = self.data.get('cit_paper')
+        # citations in order of citing year
+        order = np.argsort(store.cit_year, kind='mergesort')
+        citing_year = store.cit_year[order]
+        citing_paper = paper[order]
+        # tori contributions count from the year both papers have been published
+        tori_year = np.maximum(store.cit_year, store.year[paper])
+        sorted_tori_year = np.sort(tori_year)
+        Ntori = 0
+        tori = 0
+        # papers in order of publication year
+        papers = np.argsort(store.year, kind='mergesort')
+        publication_year = store.year[papers]
+        citations = np.zeros(len(store), dtype=np.int64)
+        published = np.zeros(len(store), dtype=bool)
+        hist = np.zeros(int(store.citations.max())+1, dtype=np.int64)
+        Ncitations = 0
+        Npapers = 0
         for year in range(minYear, maxYear+1):
-            year_data = filter(lambda a: int(a[0][:4]) <= year and a[3] <= year, tori_list)
-            tori = sum(map(lambda c: 1.0/float(c), 
-                   map(lambda b: max(b[1],config.METRICS_MIN_BIBLIO_LENGTH)*b[2],
-                   filter(lambda a: len(a) > 0, year_data))))
-            new_list = get_subset(cls.attributes,year)
-            new_list = sort_list_of_lists(new_list,2)
-            citations = map(lambda a: a[2], new_list)
-            # first calclate the Hirsch and g indices
-            rank = 1
-            N = 0
-            h = 0
-            g = 0
-            for cite in citations:
-                N += cite
-                r2 = rank*rank
-                if r2 <= N:
-                    g = rank
-                h += min(1, cite/rank)
-                rank += 1
+            # citations up to this year (the first year includes the earlier ones)
+            end = np.searchsorted(citing_year, year, side='right')
+            if end > Ncitations:
+                cited, increments = np.unique(citing_paper[Ncitations:end], return_counts=True)
+                counted = published[cited]
+                np.subtract.at(hist, citations[cited][counted], 1)
+                citations[cited] += increments
+                np.add.at(hist, citations[cited][counted], 1)
+                Ncitations = end
+            # papers published this year
+            end = np.searchsorted(publication_year, year, side='right')
+            new_papers = papers[Npapers:end]
+            published[new_papers] = True
+            np.add.at(hist, citations[new_papers], 1)
+            Npapers = end
+            end = np.searchsorted(sorted_tori_year, year, side='right')
+            if end > Ntori:
+                tori = tori_sum(self.tori_data[tori_year <= year])
+                Ntori = end
+            # calclate the Hirsch, g and i10 indices
+            h, g, i10 = histogram_indices(hist)
             TimeSpan = year - minYear + 1
-            i10 = len(filter(lambda a: a >= 10, citations))
             m = float(h)/float(TimeSpan)
             roq = int(1000.0*math.sqrt(float(tori))/float(TimeSpan))
             indices = "%s:%s:%s:%s:%s:%s" %(h,g,i10,tori,m,roq)
-            cls.series[str(year)] = indices
+            self.series[str(year)] = indices
 
-        cls.post_process()
+        self.post_process()
 
-    @classmethod
-    def pre_process(cls, *args, **kwargs):
+    def pre_process(self, *args, **kwargs):
         """
         this method gets called immediately before the data load.
         subclasses should override
         """
         pass
-    @classmethod
-    def post_process(cls, *args, **kwargs):
+    def post_process(self, *args, **kwargs):
         """
         this method gets called immediately following the data load.
         subclasses should override
@@ -298,250 +480,186 @@ class TimeSeries():
 #
 class PublicationStatistics(Statistics):
     config_data_name = 'publications'
+    column = 'publications'
 
-    @classmethod
-    def pre_process(cls):
-        data = []
-        refereed_data = []
-        for vector in cls.attributes:
-            weight = 1.0/float(vector[4])
-            data.append((1,weight))
-            if vector[1]:
-                refereed_data.append((1,weight))
-        cls.data = data
-        cls.refereed_data = refereed_data
-
-    @classmethod
-    def post_process(cls):
-        cls.results = {}
-        cls.results['type'] = cls.config_data_name
-        cls.results['Number of papers (Total)'] = cls.number_of_entries
-        cls.results['Normalized paper count (Total)'] = cls.normalized_value
-        cls.results['Number of papers (Refereed)'] = cls.number_of_refereed_entries
-        cls.results['Normalized paper count (Refereed)'] = cls.refereed_normalized_value
+    def post_process(self):
+        self.results = {}
+        self.results['type'] = self.config_data_name
+        self.results['Number of papers (Total)'] = self.number_of_entries
+        self.results['Normalized paper count (Total)'] = self.normalized_value
+        self.results['Number of papers (Refereed)'] = self.number_of_refereed_entries
+        self.results['Normalized paper count (Refereed)'] = self.refereed_normalized_value
 
 class ReadsStatistics(Statistics):
     config_data_name = 'reads'
-
-    @classmethod
-    def pre_process(cls):
-        data = []
-        refereed_data = []
-        for vector in cls.attributes:
-            weight = 1.0/float(vector[4])
-            Nreads = vector[5]
-            data.append((Nreads,weight))
-            if vector[1]:
-                refereed_data.append((Nreads,weight))
-        cls.data = data
-        cls.refereed_data = refereed_data
-
-    @classmethod
-    def post_process(cls):
-        cls.results = {}
-        cls.results['type'] = cls.config_data_name
-        cls.results['Total number of reads (Total)'] = cls.total_value
-        cls.results['Average number of reads (Total)'] = cls.mean_value
-        cls.results['Median number of reads (Total)'] = cls.median_value
-        cls.results['Normalized number of reads (Total)'] = cls.normalized_value
-        cls.results['Total number of reads (Refereed)'] = cls.refereed_total_value
-        cls.results['Average number of reads (Refereed)'] = cls.refereed_mean_value
-        cls.results['Median number of reads (Refereed)'] = cls.refereed_median_value
-        cls.results['Normalized number of reads (Refereed)'] = cls.refereed_normalized_value
+    column = 'reads'
+
+    def post_process(self):
+        self.results = {}
+        self.results['type'] = self.config_data_name
+        self.results['Total number of reads (Total)'] = self.total_value
+        self.results['Average number of reads (Total)'] = self.mean_value
+        self.results['Median number of reads (Total)'] = self.median_value
+        self.results['Normalized number of reads (Total)'] = self.normalized_value
+        self.results['Total number of reads (Refereed)'] = self.refereed_total_value
+        self.results['Average number of reads (Refereed)'] = self.refereed_mean_value
+        self.results['Median number of reads (Refereed)'] = self.refereed_median_value
+        self.results['Normalized number of reads (Refereed)'] = self.refereed_normalized_value
 
 class DownloadsStatistics(Statistics):
     config_data_name = 'downloads'
-
-    @classmethod
-    def pre_process(cls):
-        data = []
-        refereed_data = []
-        for vector in cls.attributes:
-            bbc = vector[0]
-            weight = 1.0/float(vector[4])
-            Nreads = vector[6]
-            data.append((Nreads,weight))
-            if vector[1]:
-                refereed_data.append((Nreads,weight))
-        cls.data = data
-        cls.refereed_data = refereed_data
-
-    @classmethod
-    def post_process(cls):
-        cls.results = {}
-        cls.results['type'] = cls.config_data_name
-        cls.results['Total number of downloads (Total)'] = cls.total_value
-        cls.results['Average number of downloads (Total)'] = cls.mean_value
-        cls.results['Median number of downloads (Total)'] = cls.median_value
-        cls.results['Normalized number of downloads (Total)'] = cls.normalized_value
-        cls.results['Total number of downloads (Refereed)'] = cls.refereed_total_value
-        cls.results['Average number of downloads (Refereed)'] = cls.refereed_mean_value
-        cls.results['Median number of downloads (Refereed)'] = cls.refereed_median_value
-        cls.results['Normalized number of downloads (Refereed)'] = cls.refereed_normalized_value
+    column = 'downloads'
+
+    def post_process(self):
+        self.results = {}
+        self.results['type'] = self.config_data_name
+        self.results['Total number of downloads (Total)'] = self.total_value
+        self.results['Average number of downloads (Total)'] = self.mean_value
+        self.results['Median number of downloads (Total)'] = self.median_value
+        self.results['Normalized number of downloads (Total)'] = self.normalized_value
+        self.results['Total number of downloads (Refereed)'] = self.refereed_total_value
+        self.results['Average number of downloads (Refereed)'] = self.refereed_mean_value
+        self.results['Median number of downloads (Refereed)'] = self.refereed_median_value
+        self.results['Normalized number of downloads (Refereed)'] = self.refereed_normalized_value
 
 class TotalCitationStatistics(Statistics):
     config_data_name = 'citations'
-
-    @classmethod
-    def pre_process(cls):
-        data = []
-        refereed_data = []
-        citing_papers = []
-        citing_papers_refereed = []
-        for vector in cls.attributes:
-            weight = 1.0/float(vector[4])
-            Ncites = vector[2]
-            data.append((Ncites,weight))
-            if vector[1]:
-                refereed_data.append((Ncites,weight))
-        cls.data = data
-        cls.refereed_data = refereed_data
-
-    @classmethod
-    def post_process(cls):
-        cls.results = {}
-        cls.results['type'] = cls.config_data_name
-        cls.results['Number of citing papers (Total)'] = cls.num_citing
-        cls.results['Total citations (Total)'] = cls.total_value
-        cls.results['Average citations (Total)'] = cls.mean_value
-        cls.results['Median citations (Total)'] = cls.median_value
-        cls.results['Normalized citations (Total)'] = cls.normalized_value
-        cls.results['Number of citing papers (Refereed)'] = cls.num_citing_ref
-        cls.results['Total citations (Refereed)'] = cls.refereed_total_value
-        cls.results['Average citations (Refereed)'] = cls.refereed_mean_value
-        cls.results['Median citations (Refereed)'] = cls.refereed_median_value
-        cls.results['Normalized citations (Refereed)'] = cls.refereed_normalized_value
+    column = 'citations'
+
+    def post_process(self):
+        self.results = {}
+        self.results['type'] = self.config_data_name
+        self.results['Number of citing papers (Total)'] = self.num_citing
+        self.results['Total citations (Total)'] = self.total_value
+        self.results['Average citations (Total)'] = self.mean_value
+        self.results['Median citations (Total)'] = self.median_value
+        self.results['Normalized citations (Total)'] = self.normalized_value
+        self.results['Number of citing papers (Refereed)'] = self.num_citing_ref
+        self.results['Total citations (Refereed)'] = self.refereed_total_value
+        self.results['Average citations (Refereed)'] = self.refereed_mean_value
+        self.results['Median citations (Refereed)'] = self.refereed_median_value
+        self.results['Normalized citations (Refereed)'] = self.refereed_normalized_value
 
 class RefereedCitationStatistics(Statistics):
     config_data_name = 'refereed_citations'
-
-    @classmethod
-    def pre_process(cls):
-        data = []
-        refereed_data = []
-        for vector in cls.attributes:
-            weight = 1.0/float(vector[4])
-            Ncites = vector[3]
-            data.append((Ncites,weight))
-            if vector[1]:
-                refereed_data.append((Ncites,weight))
-        cls.data = data
-        cls.refereed_data = refereed_data
-
-    @classmethod
-    def post_process(cls):
-        cls.results = {}
-        cls.results['type'] = cls.config_data_name
-        cls.results['Refereed citations (Total)'] = cls.total_value
-        cls.results['Average refereed citations (Total)'] = cls.mean_value
-        cls.results['Median refereed citations (Total)'] = cls.median_value
-        cls.results['Normalized refereed citations (Total)'] = cls.normalized_value
-        cls.results['Refereed citations (Refereed)'] = cls.refereed_total_value
-        cls.results['Average refereed citations (Refereed)'] = cls.refereed_mean_value
-        cls.results['Median refereed citations (Refereed)'] = cls.refereed_median_value
-        cls.results['Normalized refereed citations (Refereed)'] = cls.refereed_normalized_value
+    column = 'refereed_citations'
+
+    def post_process(self):
+        self.results = {}
+        self.results['type'] = self.config_data_name
+        self.results['Refereed citations (Total)'] = self.total_value
+        self.results['Average refereed citations (Total)'] = self.mean_value
+        self.results['Median refereed citations (Total)'] = self.median_value
+        self.results['Normalized refereed citations (Total)'] = self.normalized_value
+        self.results['Refereed citations (Refereed)'] = self.refereed_total_value
+        self.results['Average refereed citations (Refereed)'] = self.refereed_mean_value
+        self.results['Median refereed citations (Refereed)'] = self.refereed_median_value
+        self.results['Normalized refereed citations (Refereed)'] = self.refereed_normalized_value
 
 class TotalMetrics(Metrics):
     config_data_name = 'metrics'
-
-    @classmethod
-    def pre_process(cls):
-        biblist = map(lambda a: a[0], cls.attributes)
-        cls.time_span = get_timespan(biblist)
-        cls.refereed = 0
-        cls.citations = map(lambda a: a[2], cls.attributes)
-        cls.tori_data = map(lambda a: a[8], cls.attributes)
-
-    @classmethod
-    def post_process(cls):
-        cls.results = {}
-        cls.results['type'] = cls.config_data_name
-        cls.results['H-index (Total)'] = cls.h_index
-        cls.results['g-index (Total)'] = cls.g_index
-        cls.results['m-index (Total)'] = cls.m_index
-        cls.results['i10-index (Total)'] = cls.i10_index
-        cls.results['e-index (Total)'] = cls.e_index
-        cls.results['tori index (Total)'] = cls.tori
-        cls.results['roq index (Total)'] = cls.riq
+    requires = ('time_span', 'sorted_citations', 'tori_weights')
+
+    def pre_process(self):
+        self.time_span = self.data.get('time_span')
+        self.refereed = 0
+        self.citations = self.data.get('sorted_citations')
+        self.tori_data = self.data.get('tori_weights')
+
+    def post_process(self):
+        self.results = {}
+        self.results['type'] = self.config_data_name
+        self.results['H-index (Total)'] = self.h_index
+        self.results['g-index (Total)'] = self.g_index
+        self.results['m-index (Total)'] = self.m_index
+        self.results['i10-index (Total)'] = self.i10_index
+        self.results['e-index (Total)'] = self.e_index
+        self.results['tori index (Total)'] = self.tori
+        self.results['roq index (Total)'] = self.riq
 
 class RefereedMetrics(Metrics):
     config_data_name = 'refereed_metrics'
-
-    @classmethod
-    def pre_process(cls):
-        biblist = map(lambda a: a[0], cls.attributes)
-        cls.time_span = get_timespan(biblist)
-        cls.refereed = 1
-        cls.citations = map(lambda b: b[2],
-                           filter(lambda a: a[1] == 1, cls.attributes))
-        cls.tori_data = map(lambda a: a[9], cls.attributes)
-
-    @classmethod
-    def post_process(cls):
-        cls.results = {}
-        cls.results['type'] = cls.config_data_name
-        cls.results['H-index (Refereed)'] = cls.h_index
-        cls.results['g-index (Refereed)'] = cls.g_index
-        cls.results['m-index (Refereed)'] = cls.m_index
-        cls.results['i10-index (Refereed)'] = cls.i10_index
-        cls.results['e-index (Refereed)'] = cls.e_index
-        cls.results['tori index (Refereed)'] = cls.tori
-        cls.results['roq index (Refereed)'] = cls.riq
+    requires = ('time_span', 'sorted_refereed_citations', 'tori_weights')
+
+    def pre_process(self):
+        self.time_span = self.data.get('time_span')
+        self.refereed = 1
+        self.citations = self.data.get('sorted_refereed_citations')
+        self.tori_data = self.data.get('tori_weights')[self.attributes.cit_refereed]
+
+    def post_process(self):
+        self.results = {}
+        self.results['type'] = self.config_data_name
+        self.results['H-index (Refereed)'] = self.h_index
+        self.results['g-index (Refereed)'] = self.g_index
+        self.results['m-index (Refereed)'] = self.m_index
+        self.results['i10-index (Refereed)'] = self.i10_index
+        self.results['e-index (Refereed)'] = self.e_index
+        self.results['tori index (Refereed)'] = self.tori
+        self.results['roq index (Refereed)'] = self.riq
 
 class PublicationHistogram(Histogram):
     config_data_name = 'publication_histogram'
-
-    @classmethod
-    def pre_process(cls):
-        data = []
-        refereed_data = []
-        for vector in cls.attributes:
-            year = int(vector[0][:4])
-            weight = 1.0/float(vector[4])
-            if vector[1]:
-                refereed_data.append((year,weight))
-            data.append((year,weight))
-        cls.data = data
-        cls.refereed_data = refereed_data
-        cls.min_year = ''
-
-    @classmethod
-    def post_process(cls):
-        cls.results['type'] = cls.config_data_name
-        if cls.value_histogram:
-            Nentries = len(cls.value_histogram[0])
+    requires = ('weights',)
+
+    def pre_process(self):
+        store = self.attributes
+        self.values = store.year
+        self.weights = self.data.get('weights')
+        self.refereed = store.refereed
+        self.min_year = ''
+
+    def post_process(self):
+        self.results['type'] = self.config_data_name
+        if self.value_histogram:
+            Nentries = len(self.value_histogram[0])
             for i in range(Nentries):
-                year = cls.value_histogram[1][i]
-                res = "%s:%s:%s:%s" % (cls.value_histogram[0][i],cls.refereed_value_histogram[0][i],cls.normalized_value_histogram[0][i],cls.refereed_normalized_value_histogram[0][i])
-                cls.results[str(year)] = res
+                year = self.value_histogram[1][i]
+                res = "%s:%s:%s:%s" % (self.value_histogram[0][i],self.refereed_value_histogram[0][i],self.normalized_value_histogram[0][i],self.refereed_normalized_value_histogram[0][i])
+                self.results[str(year)] = res
 
 class ReadsHistogram(Histogram):
     config_data_name = 'reads_histogram'
+    requires = ('weights', 'reads_matrix')
 
-    @classmethod
-    def pre_process(cls):
-        data = []
-        refereed_data = []
-        for vec in cls.attributes:
-            Nreads = len(vec[7])
-            for i in range(Nreads):
-                for j in range(vec[7][i]):
-                    data.append((1996+i,1.0/float(vec[4])))
-                    if vec[1]:
-                        refereed_data.append((1996+i,1.0/float(vec[4])))
-        cls.data = data
-        cls.refereed_data = refereed_data
-        cls.min_year = ''
-
-    @classmethod
-    def post_process(cls):
-        cls.results['type'] = cls.config_data_name
-        if cls.value_histogram:
-            Nentries = len(cls.value_histogram[0])
+    def generate_data(self):
+        """
+        The yearly reads are used directly as frequencies: the histograms
+        are (weighted) sums over the columns of the (papers x years) reads
+        matrix, so no entry is created for every single read.
+        """
+        self.results = {}
+        today = datetime.today()
+        store = self.attributes
+        bins = np.arange(READS_START_YEAR, today.year+2)
+        Nbins = len(bins) - 1
+        matrix = np.maximum(self.data.get('reads_matrix'), 0)
+        reads = np.zeros((len(store), Nbins), dtype=np.int64)
+        Ncolumns = min(matrix.shape[1], Nbins)
+        reads[:,:Ncolumns] = matrix[:,:Ncolumns]
+        # like numpy.histogram, the last bin includes its upper edge
+        if matrix.shape[1] > Nbins:
+            reads[:,-1] += matrix[:,Nbins]
+        if reads.any():
+            weights = self.data.get('weights')
+            refereed = store.refereed
+            self.value_histogram = (reads.sum(axis=0), bins)
+            self.refereed_value_histogram = (reads[refereed].sum(axis=0), bins)
+            self.normalized_value_histogram = (weights.dot(reads), bins)
+            self.refereed_normalized_value_histogram = (weights[refereed].dot(reads[refereed]), bins)
+        else:
+            self.value_histogram = False
+            self.results[str(today.year)] = "0:0:0:0"
+        self.post_process()
+
+    def post_process(self):
+        self.results['type'] = self.config_data_name
+        if self.value_histogram:
+            Nentries = len(self.value_histogram[0])
             for i in range(Nentries):
-                year = cls.value_histogram[1][i]
-                res = "%s:%s:%s:%s" % (cls.value_histogram[0][i],cls.refereed_value_histogram[0][i],cls.normalized_value_histogram[0][i],cls.refereed_normalized_value_histogram[0][i])
-                cls.results[str(year)] = res
+                year = self.value_histogram[1][i]
+                res = "%s:%s:%s:%s" % (self.value_histogram[0][i],self.refereed_value_histogram[0][i],self.normalized_value_histogram[0][i],self.refereed_normalized_value_histogram[0][i])
+                self.results[str(year)] = res
 
 class AllCitationsHistogram(Histogram):
     '''
@@ -550,33 +668,23 @@ class AllCitationsHistogram(Histogram):
     non-refereed papers
     '''
     config_data_name = 'all_citation_histogram'
-
-    @classmethod
-    def pre_process(cls):
-        data = []
-        refereed_data = []
-        min_year = 9999
-        for vec in cls.attributes:
-            min_year = min(int(vec[0][:4]), min_year)
-            for citation in vec[8]:
-                data.append((int(citation[0][:4]), 1.0/float(vec[4])))
-                if vec[1]:
-                    refereed_data.append((int(citation[0][:4]), 1.0/float(vec[4])))
-#                else:
-#                    data.append((int(citation[0][:4]), 1.0/float(vec[4])))
-        cls.data = data
-        cls.refereed_data = refereed_data
-        cls.min_year = min_year
-
-    @classmethod
-    def post_process(cls):
-        cls.results['type'] = cls.config_data_name
-        if cls.value_histogram:
-            Nentries = len(cls.value_histogram[0])
+    requires = ('citation_histograms',)
+
+    def generate_data(self):
+        self.results = {}
+        (self.value_histogram, self.refereed_value_histogram, self.normalized_value_histogram,
+         self.refereed_normalized_value_histogram) = \
+            self.data.get('citation_histograms')[self.config_data_name]
+        self.post_process()
+
+    def post_process(self):
+        self.results['type'] = self.config_data_name
+        if self.value_histogram:
+            Nentries = len(self.value_histogram[0])
             for i in range(Nentries):
-                year = cls.value_histogram[1][i]
-                res = "%s:%s:%s:%s" % (cls.value_histogram[0][i],cls.refereed_value_histogram[0][i],cls.normalized_value_histogram[0][i],cls.refereed_normalized_value_histogram[0][i])
-                cls.results[str(year)] = res.split(':')
+                year = self.value_histogram[1][i]
+                res = "%s:%s:%s:%s" % (self.value_histogram[0][i],self.refereed_value_histogram[0][i],self.normalized_value_histogram[0][i],self.refereed_normalized_value_histogram[0][i])
+                self.results[str(year)] = res.split(':')
 
 class RefereedCitationsHistogram(Histogram):
     '''
@@ -585,33 +693,23 @@ class RefereedCitationsHistogram(Histogram):
     non-refereed papers
     '''
     config_data_name = 'refereed_citation_histogram'
-
-    @classmethod
-    def pre_process(cls):
-        data = []
-        refereed_data = []
-        min_year = 9999
-        for vec in cls.attributes:
-            min_year = min(int(vec[0][:4]), min_year)
-            for citation in vec[9]:
-                data.append((int(citation[0][:4]), 1.0/float(vec[4])))
-                if vec[1]:
-                    refereed_data.append((int(citation[0][:4]), 1.0/float(vec[4])))
-#                else:
-#                    data.append((int(citation[0][:4]), 1.0/float(vec[4])))
-        cls.data = data
-        cls.refereed_data = refereed_data
-        cls.min_year = min_year
-
-    @classmethod
-    def post_process(cls):
-        cls.results['type'] = cls.config_data_name
-        if cls.value_histogram:
-            Nentries = len(cls.value_histogram[0])
+    requires = ('citation_histograms',)
+
+    def generate_data(self):
+        self.results = {}
+        (self.value_histogram, self.refereed_value_histogram, self.normalized_value_histogram,
+         self.refereed_normalized_value_histogram) = \
+            self.data.get('citation_histograms')[self.config_data_name]
+        self.post_process()
+
+    def post_process(self):
+        self.results['type'] = self.config_data_name
+        if self.value_histogram:
+            Nentries = len(self.value_histogram[0])
             for i in range(Nentries):
-                year = cls.value_histogram[1][i]
-                res = "%s:%s:%s:%s" % (cls.value_histogram[0][i],cls.refereed_value_histogram[0][i],cls.normalized_value_histogram[0][i],cls.refereed_normalized_value_histogram[0][i])
-                cls.results[str(year)] = res.split(':')
+                year = self.value_histogram[1][i]
+                res = "%s:%s:%s:%s" % (self.value_histogram[0][i],self.refereed_value_histogram[0][i],self.normalized_value_histogram[0][i],self.refereed_normalized_value_histogram[0][i])
+                self.results[str(year)] = res.split(':')
 
 class NonRefereedCitationsHistogram(Histogram):
     '''
@@ -620,42 +718,31 @@ class NonRefereedCitationsHistogram(Histogram):
     non-refereed papers
     '''
     config_data_name = 'non_refereed_citation_histogram'
-
-    @classmethod
-    def pre_process(cls):
-        data = []
-        refereed_data = []
-        min_year = 9999
-        for vec in cls.attributes:
-            min_year = min(int(vec[0][:4]), min_year)
-            for citation in vec[10]:
-                data.append((int(citation[0][:4]), 1.0/float(vec[4])))
-                if vec[1]:
-                    refereed_data.append((int(citation[0][:4]), 1.0/float(vec[4])))
-#                else:
-#                    data.append((int(citation[0][:4]), 1.0/float(vec[4])))
-        cls.data = data
-        cls.refereed_data = refereed_data
-        cls.min_year = min_year
-
-    @classmethod
-    def post_process(cls):
-        cls.results['type'] = cls.config_data_name
-        if cls.value_histogram:
-            Nentries = len(cls.value_histogram[0])
+    requires = ('citation_histograms',)
+
+    def generate_data(self):
+        self.results = {}
+        (self.value_histogram, self.refereed_value_histogram, self.normalized_value_histogram,
+         self.refereed_normalized_value_histogram) = \
+            self.data.get('citation_histograms')[self.config_data_name]
+        self.post_process()
+
+    def post_process(self):
+        self.results['type'] = self.config_data_name
+        if self.value_histogram:
+            Nentries = len(self.value_histogram[0])
             for i in range(Nentries):
-                year = cls.value_histogram[1][i]
-                res = "%s:%s:%s:%s" % (cls.value_histogram[0][i],cls.refereed_value_histogram[0][i],cls.normalized_value_histogram[0][i],cls.refereed_normalized_value_histogram[0][i])
-                cls.results[str(year)] = res.split(':')
+                year = self.value_histogram[1][i]
+                res = "%s:%s:%s:%s" % (self.value_histogram[0][i],self.refereed_value_histogram[0][i],self.normalized_value_histogram[0][i],self.refereed_normalized_value_histogram[0][i])
+                self.results[str(year)] = res.split(':')
 
 class MetricsSeries(TimeSeries):
     config_data_name = 'metrics_series'
+    requires = ('cit_paper', 'tori_weights')
 
-    @classmethod
-    def pre_process(cls):
-        cls.tori_data = map(lambda a: a[8], cls.attributes)
+    def pre_process(self):
+        self.tori_data = self.data.get('tori_weights')
 
-    @classmethod
-    def post_process(cls):
-        cls.results = cls.series
-        cls.results['type'] = cls.config_data_name
\ No newline at end of file
+    def post_process(self):
+        self.results = self.series
+        self.results['type'] = self.config_data_name
\ No newline at end of file
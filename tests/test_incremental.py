@@ -0,0 +1,83 @@
+"""
+Updates a bibliography of the corpus of 'test_models' incrementally and
+compares the results with those of the models on the updated data.
+
+    python -m unittest discover tests
+"""
+import unittest
+# metrics specific modules
+from adsstats.attributes import AttributeStore, csr_offsets
+from adsstats.incremental import Bibliography
+from tests.test_models import BIBCODES, REFEREED, AUTHORS, READS, DOWNLOADS, CITATIONS
+
+TYPES = 'statistics,histograms,metrics,series'
+
+def make_store(citations, reads, downloads):
+    flat = [c for cits in citations for c in cits]
+    return AttributeStore(BIBCODES, REFEREED, AUTHORS, [sum(r) for r in reads], downloads,
+                          csr_offsets(map(len, reads)), [n for r in reads for n in r],
+                          csr_offsets(map(len, citations)), [c[0] for c in flat],
+                          [c[1] for c in flat], [c[2] for c in flat])
+
+def citing(cited, year, refs, refereed):
+    return (BIBCODES[cited], '%dMNRAS.000....1Z' % year, refs, refereed)
+
+class IncrementalTest(unittest.TestCase):
+
+    def assertResults(self, results, expected):
+        """
+        Compares two sets of results, floats up to rounding
+        """
+        self.assertEqual(sorted(results), sorted(expected))
+        for name in expected:
+            self.assertEqual(sorted(results[name]), sorted(expected[name]))
+            for key in expected[name]:
+                value, other = results[name][key], expected[name][key]
+                if value == other:
+                    continue
+                if not isinstance(value, list):
+                    value, other = (str(value).split(':'), str(other).split(':'))
+                self.assertEqual(len(value), len(other))
+                for (v, o) in zip(value, other):
+                    self.assertAlmostEqual(float(v), float(o), msg='%s %s' % (name, key))
+
+    def test_update(self):
+        bib = Bibliography(make_store(CITATIONS, READS, DOWNLOADS), types=TYPES)
+        citations = [list(cits) for cits in CITATIONS]
+        reads = [list(r) for r in READS]
+        downloads = list(DOWNLOADS)
+        # new citations, for papers without citations and beyond the h-index
+        added = [(4, 2007, 12, True), (4, 2009, 2, False), (3, 2010, 25, True),
+                 (2, 2011, 30, True), (0, 1999, 10, True)]
+        removed = [(1, 2004, 50, False), (0, 2001, 10, True)]
+        for (paper, year, refs, refereed) in added:
+            citations[paper].append((year, refs, refereed))
+        for (paper, year, refs, refereed) in removed:
+            citations[paper].remove((year, refs, refereed))
+        reads[3] = [0, 0, 0, 0, 0, 0, 0, 0, 2]
+        reads[0][1] += 6
+        downloads[2] += 5
+        bib.update(add_citations=[citing(*c) for c in added],
+                   remove_citations=[citing(*c) for c in removed],
+                   reads=[(BIBCODES[3], 2004, 2), (BIBCODES[0], 1997, 6)],
+                   downloads=[(BIBCODES[2], 5)])
+        expected = Bibliography(make_store(citations, reads, downloads), types=TYPES)
+        self.assertResults(bib.generate(), expected.generate())
+        # and back again
+        bib.update(add_citations=[citing(*c) for c in removed],
+                   remove_citations=[citing(*c) for c in added])
+        citations = [list(cits) for cits in CITATIONS]
+        expected = Bibliography(make_store(citations, reads, downloads), types=TYPES)
+        self.assertResults(bib.generate(), expected.generate())
+
+    def test_invalid_update(self):
+        bib = Bibliography(make_store(CITATIONS, READS, DOWNLOADS), types=TYPES)
+        before = bib.generate()
+        self.assertRaises(ValueError, bib.update, add_citations=[citing(4, 2007, 12, True)],
+                          remove_citations=[citing(3, 2010, 25, False)])
+        self.assertRaises(ValueError, bib.update, add_citations=[citing(4, 2007, 12, True)],
+                          reads=[(BIBCODES[0], 1990, 3)])
+        self.assertEqual(bib.generate(), before)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+"""
+Runs the models on a small corpus with known outputs (the values of the
+original, list based, models on the same papers).
+
+    python -m unittest discover tests
+"""
+import unittest
+# metrics specific modules
+import models
+from adsstats.attributes import AttributeStore, csr_offsets
+
+BIBCODES = ['2000ApJ...500....1A', '2001ApJ...501....1B', '2002ApJ...502....1C',
+            '2003ApJ...503....1D', '2005ApJ...505....1E']
+REFEREED = [True, True, False, True, False]
+AUTHORS = [1, 2, 4, 1, 5]
+# reads per year, starting in 1996
+READS = [[0, 0, 0, 0, 5, 10], [0, 0, 0, 0, 0, 1, 2], [3], [], [0] * 9 + [4]]
+DOWNLOADS = [7, 3, 0, 0, 2]
+# citations per paper: (year, number of references, refereed) of the citing paper
+CITATIONS = [[(2001, 10, True)] * 4 + [(2003, 3, False)] * 3 + [(2006, 20, True)] * 3,
+             [(2002, 5, True)] * 2 + [(2004, 50, False)] * 2 + [(2004, 8, True)] * 2,
+             [(2003, 10, True), (2005, 10, False), (2008, 4, True)],
+             [(2010, 25, True)],
+             []]
+NUM_CITING = 40
+NUM_CITING_REF = 22
+
+def make_store():
+    citations = [c for cits in CITATIONS for c in cits]
+    store = AttributeStore(BIBCODES, REFEREED, AUTHORS, [sum(r) for r in READS], DOWNLOADS,
+                           csr_offsets(map(len, READS)), [n for r in READS for n in r],
+                           csr_offsets(map(len, CITATIONS)), [c[0] for c in citations],
+                           [c[1] for c in citations], [c[2] for c in citations])
+    return store.sort_by_citations()
+
+class ModelsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        classes = models.data_models(models=['statistics', 'histograms', 'metrics', 'series'])
+        results = models.run_models(classes, make_store(), NUM_CITING, NUM_CITING_REF)
+        cls.results = dict((c.config_data_name, r) for (c, r) in zip(classes, results))
+
+    def assertFields(self, value, expected):
+        """
+        Compares the ':' separated fields of a histogram or series entry:
+        counts exactly, normalized values up to rounding
+        """
+        if not isinstance(value, list):
+            value, expected = (value.split(':'), expected.split(':'))
+        self.assertEqual(len(value), len(expected))
+        for (v, e) in zip(value, expected):
+            if '.' in e:
+                self.assertAlmostEqual(float(v), float(e))
+            else:
+                self.assertEqual(v, e)
+
+    def test_metrics(self):
+        self.assertEqual(self.results['metrics'], {
+            'type': 'metrics',
+            'H-index (Total)': 3,
+            'g-index (Total)': 4,
+            'i10-index (Total)': 1,
+            'e-index (Total)': 3.1622776601683795,
+            'm-index (Total)': 0.5,
+            'roq index (Total)': 213,
+            'tori index (Total)': 1.6350000000000002})
+        self.assertEqual(self.results['refereed_metrics'], {
+            'type': 'refereed_metrics',
+            'H-index (Refereed)': 2,
+            'g-index (Refereed)': 3,
+            'i10-index (Refereed)': 1,
+            'e-index (Refereed)': 3.4641016151377544,
+            'm-index (Refereed)': 0.3333333333333333,
+            'roq index (Refereed)': 165,
+            'tori index (Refereed)': 0.9900000000000001})
+
+    def test_statistics(self):
+        self.assertEqual(self.results['publications'], {
+            'type': 'publications',
+            'Number of papers (Total)': 5,
+            'Number of papers (Refereed)': 3,
+            'Normalized paper count (Total)': 2.95,
+            'Normalized paper count (Refereed)': 2.5})
+        self.assertEqual(self.results['citations'], {
+            'type': 'citations',
+            'Number of citing papers (Total)': 40,
+            'Number of citing papers (Refereed)': 22,
+            'Total citations (Total)': 20,
+            'Total citations (Refereed)': 17,
+            'Average citations (Total)': 4.0,
+            'Average citations (Refereed)': 5.666666666666667,
+            'Median citations (Total)': 3.0,
+            'Median citations (Refereed)': 6.0,
+            'Normalized citations (Total)': 14.75,
+            'Normalized citations (Refereed)': 14.0})
+        self.assertEqual(self.results['refereed_citations'], {
+            'type': 'refereed_citations',
+            'Refereed citations (Total)': 14,
+            'Refereed citations (Refereed)': 12,
+            'Average refereed citations (Total)': 2.8,
+            'Average refereed citations (Refereed)': 4.0,
+            'Median refereed citations (Total)': 2.0,
+            'Median refereed citations (Refereed)': 4.0,
+            'Normalized refereed citations (Total)': 10.5,
+            'Normalized refereed citations (Refereed)': 10.0})
+        self.assertEqual(self.results['reads'], {
+            'type': 'reads',
+            'Total number of reads (Total)': 25,
+            'Total number of reads (Refereed)': 18,
+            'Average number of reads (Total)': 5.0,
+            'Average number of reads (Refereed)': 6.0,
+            'Median number of reads (Total)': 3.0,
+            'Median number of reads (Refereed)': 3.0,
+            'Normalized number of reads (Total)': 18.05,
+            'Normalized number of reads (Refereed)': 16.5})
+        self.assertEqual(self.results['downloads'], {
+            'type': 'downloads',
+            'Total number of downloads (Total)': 12,
+            'Total number of downloads (Refereed)': 10,
+            'Average number of downloads (Total)': 2.4,
+            'Average number of downloads (Refereed)': 3.3333333333333335,
+            'Median number of downloads (Total)': 2.0,
+            'Median number of downloads (Refereed)': 3.0,
+            'Normalized number of downloads (Total)': 8.9,
+            'Normalized number of downloads (Refereed)': 8.5})
+
+    def test_histograms(self):
+        expected = {
+            'publication_histogram': {
+                '2000': '1:1:1.0:1.0', '2001': '1:1:0.5:0.5', '2002': '1:0:0.25:0.0',
+                '2003': '1:1:1.0:1.0', '2004': '0:0:0.0:0.0', '2005': '1:0:0.2:0.0'},
+            'reads_histogram': {
+                '1996': '3:0:0.75:0.0', '1999': '0:0:0.0:0.0', '2000': '5:5:5.0:5.0',
+                '2001': '11:11:10.5:10.5', '2002': '2:2:1.0:1.0', '2005': '4:0:0.8:0.0'},
+            'all_citation_histogram': {
+                '2000': ['0', '0', '0.0', '0.0'], '2001': ['4', '4', '4.0', '4.0'],
+                '2002': ['2', '2', '1.0', '1.0'], '2003': ['4', '3', '3.25', '3.0'],
+                '2004': ['4', '4', '2.0', '2.0'], '2005': ['1', '0', '0.25', '0.0'],
+                '2006': ['3', '3', '3.0', '3.0'], '2007': ['0', '0', '0.0', '0.0'],
+                '2008': ['1', '0', '0.25', '0.0'], '2010': ['1', '1', '1.0', '1.0']},
+            'refereed_citation_histogram': {
+                '2001': ['4', '4', '4.0', '4.0'], '2002': ['2', '2', '1.0', '1.0'],
+                '2003': ['1', '0', '0.25', '0.0'], '2004': ['2', '2', '1.0', '1.0'],
+                '2005': ['0', '0', '0.0', '0.0'], '2006': ['3', '3', '3.0', '3.0'],
+                '2008': ['1', '0', '0.25', '0.0'], '2010': ['1', '1', '1.0', '1.0']},
+            'non_refereed_citation_histogram': {
+                '2001': ['0', '0', '0.0', '0.0'], '2003': ['3', '3', '3.0', '3.0'],
+                '2004': ['2', '2', '1.0', '1.0'], '2005': ['1', '0', '0.25', '0.0'],
+                '2006': ['0', '0', '0.0', '0.0'], '2010': ['0', '0', '0.0', '0.0']},
+        }
+        for (name, years) in expected.items():
+            self.assertEqual(self.results[name]['type'], name)
+            for (year, value) in years.items():
+                self.assertFields(self.results[name][year], value)
+
+    def test_series(self):
+        series = self.results['metrics_series']
+        self.assertEqual(series['type'], 'metrics_series')
+        # year: h:g:i10:tori:m:roq
+        expected = {
+            '2000': '0:0:0:0:0.0:0',
+            '2001': '1:2:0:0.4:0.5:316',
+            '2002': '2:2:0:0.6:0.666666666667:258',
+            '2003': '2:3:0:1.225:0.5:276',
+            '2004': '2:3:0:1.37:0.4:234',
+            '2005': '2:3:0:1.395:0.333333333333:196',
+            '2006': '2:4:1:1.545:0.285714285714:177',
+            '2007': '2:4:1:1.545:0.25:155',
+            '2008': '3:4:1:1.595:0.333333333333:140',
+            '2009': '3:4:1:1.595:0.3:126',
+            '2010': '3:4:1:1.635:0.272727272727:116',
+            '2011': '3:4:1:1.635:0.25:106',
+            '2012': '3:4:1:1.635:0.230769230769:98'}
+        for (year, value) in expected.items():
+            self.assertEqual(series[year], value)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+Runs the metrics service on a synthetic corpus with the local Solr and
+adsdata stand-ins (see 'service.use_standins').
+
+    python -m unittest discover tests
+"""
+import threading
+import unittest
+import requests
+# metrics specific modules
+from config import config
+from adsstats import service, stats_utils
+
+class ServiceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.saved = (config.SOLR_URL, config.METRICS_BACKEND, config.METRICS_BATCH_WINDOW,
+                     stats_utils._session)
+        # a long window, so that concurrent requests always share a batch
+        config.METRICS_BATCH_WINDOW = 0.5
+        cls.bibcodes = service.use_standins(200)
+        cls.server = service.make_server('127.0.0.1', 0)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.url = 'http://127.0.0.1:%d' % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        (config.SOLR_URL, config.METRICS_BACKEND, config.METRICS_BATCH_WINDOW,
+         stats_utils._session) = cls.saved
+
+    def post(self, body, **kwargs):
+        return requests.post(self.url + '/metrics', json=body, timeout=60, **kwargs)
+
+    def post_all(self, bodies):
+        """
+        Send the requests 'bodies' at the same time; returns the responses
+        """
+        responses = [None] * len(bodies)
+        def run(i):
+            responses[i] = self.post(bodies[i])
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(bodies))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_metrics(self):
+        bibcodes = self.bibcodes[:40]
+        r = self.post({'bibcodes': bibcodes, 'types': 'statistics'})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()['all stats']['Number of papers'], len(bibcodes))
+
+    def test_batch(self):
+        before = self.server.service.batcher.stats()
+        bodies = [{'bibcodes': self.bibcodes[10*i:10*i+25], 'types': 'statistics,metrics'}
+                  for i in range(6)]
+        responses = self.post_all(bodies)
+        after = self.server.service.batcher.stats()
+        self.assertEqual([r.status_code for r in responses], [200] * len(bodies))
+        for (body, r) in zip(bodies, responses):
+            self.assertEqual(r.json()['all stats']['Number of papers'], len(body['bibcodes']))
+        self.assertEqual(after['batched_requests'] - before['batched_requests'], len(bodies))
+        self.assertLess(after['batches'] - before['batches'], len(bodies))
+
+    def test_failing_request_in_batch(self):
+        good = {'bibcodes': self.bibcodes[50:70], 'types': 'statistics'}
+        bad = {'bibcodes': ['2099NOPE.........1'], 'types': 'statistics'}
+        responses = self.post_all([good, bad, good])
+        self.assertEqual([r.status_code for r in responses], [200, 500, 200])
+        self.assertIn('error', responses[1].json())
+
+    def test_malformed_requests(self):
+        for body in ({'types': 'statistics'},
+                     {'bibcodes': self.bibcodes[0]},
+                     {'bibcodes': [1, 2]},
+                     {'bibcodes': []},
+                     {'bibcodes': self.bibcodes[:5], 'types': ['metrics']},
+                     {'bibcodes': self.bibcodes[:5], 'fmt': 1},
+                     {'query': ['bibcode:X']},
+                     ['not', 'an', 'object']):
+            r = self.post(body)
+            self.assertEqual(r.status_code, 400, body)
+            self.assertIn('error', r.json())
+        r = requests.post(self.url + '/metrics', data='not json', timeout=60)
+        self.assertEqual(r.status_code, 400)
+        r = requests.get(self.url + '/nowhere', timeout=60)
+        self.assertEqual(r.status_code, 404)
+        # nothing is left waiting in the service
+        self.assertEqual(requests.get(self.url + '/stats', timeout=60).json()['in_flight'], 0)
+
+    def test_ping(self):
+        r = requests.get(self.url + '/ping', timeout=60)
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.json()['executor']['ok'])
+
+if __name__ == '__main__':
+    unittest.main()